@@ -1,6 +1,13 @@
 import networkx as nx
 import random
 import pandas as pd
+import csr_graph
+import data_cache
+import edge_formation
+import graph_overlay
+import instrumentation
+import play_counts
+import seed_selection
 
 
 def load_data():
@@ -44,8 +51,10 @@ def calc_buying_probability(G, nodes_group, test_flag=False):
     :param test_flag: boolean. True if the calculation is done for IC calculation, else False.
     :return: None (only updating attributes of nodes)
     """
+    neighbor_visits = 0
     for n in nodes_group:
         nt = G.degree(n)
+        neighbor_visits += nt
         h = G.nodes[n]["h"]
         if test_flag:
             bt = len([v for v in G.neighbors(n) if G.nodes[v]["infected test"]])
@@ -61,6 +70,7 @@ def calc_buying_probability(G, nodes_group, test_flag=False):
                 G.nodes[n]["buying probability"] = bt / nt
             else:
                 G.nodes[n]["buying probability"] = ((h * bt) / (1000 * nt))
+    instrumentation.count("neighbor visits", neighbor_visits)
 
 
 def IC(S, G):
@@ -70,6 +80,7 @@ def IC(S, G):
     :param G: graph
     :return: influence cone rank of S
     """
+    instrumentation.count("IC calls")
     influence_cone = len(S)
     for s in S:
         G.nodes[s]["infected test"] = True
@@ -114,12 +125,17 @@ def add_new_edges(G: nx.Graph, P):
     :param P: new edges probability matrix (dict)
     :return: None (add new edges to G based on P).
     """
+    draws = 0
+    edges_before = G.number_of_edges()
     for i in G.nodes:
         for j in G.nodes:
             if i < j and not G.has_edge(i, j):  # saving calculation cost - the matrix is symmetric
                 u = random.random()
+                draws += 1
                 if u < P[(i, j)]:
                     G.add_edge(i, j)
+    instrumentation.count("random draws", draws)
+    instrumentation.count("edges added", G.number_of_edges() - edges_before)
 
 
 def build_probabilities_dict(G, probability_function, hist=None):
@@ -137,9 +153,31 @@ def build_probabilities_dict(G, probability_function, hist=None):
         for j in G.nodes:
             if i < j:  # saving calculation cost - the matrix is symmetric
                 P[(i, j)] = probability_function(G_0, G_1, i, j, hist)
+    instrumentation.count("pair probability evaluations", len(P))
     return P
 
 
+def build_probability_model(G, probability_function, hist=None):
+    """
+    Lazy alternative of build_probabilities_dict: the same probabilities without a dict entry per pair of nodes.
+    friendly_index and common_neighbors_index are evaluated only on pairs that had common friends in G_1 (all other
+    pairs get 0 and hist[0] respectively), any other probability_function is assumed to be a constant index made by
+    prob_p_forall_index. P[(i,j)] works like the dict, so add_new_edges accepts the model as is.
+    :param G: network graph
+    :param probability_function: probability for each two nodes i, j to become friends at the network
+    :param hist: relevant only if probability_function == common_neighbors_index. view this function's docstring
+                 for more details.
+    :return: new edge probabilities model P (edge_formation.PairProbabilities)
+    """
+    ids = sorted(G.nodes)
+    if probability_function == friendly_index:
+        return edge_formation.friendly_index_probabilities(ids, csr_graph.as_csr_graph(G_0),
+                                                           csr_graph.as_csr_graph(G_1))
+    if probability_function == common_neighbors_index:
+        return edge_formation.common_neighbors_index_probabilities(ids, csr_graph.as_csr_graph(G_1), hist)
+    return edge_formation.uniform_probabilities(ids, probability_function(G_0, G_1, None, None, hist))
+
+
 def friendly_index(G_0, G_1, u, v, hist=None):
     """
     An index with a sociological orientation based on the tendency of each node to create new friends based on the
@@ -197,7 +235,7 @@ def common_neighbors_index(G_0, G_1, u, v, hist):
                  friends that the two nodes had in time=-1.
     :return: probability of (u,v) edge to form
     """
-    common_neighbors = len(set(nx.common_neighbors(G_1, u, v)))
+    common_neighbors = len(set(G_1.neighbors(u)) & set(G_1.neighbors(v)) - {u, v})
     return hist[common_neighbors]
 
 
@@ -210,7 +248,7 @@ def new_edges_by_commoneighbors_histogram(G_0, G_1):
     :return: histogram
     """
     histogram = {}
-    max_degree = sorted(G_1.degree, key=lambda x: x[1], reverse=True)[0][1]
+    max_degree = max(d for n, d in G_1.degree)
 
     # initialization
     for i in range(max_degree + 1):
@@ -221,7 +259,7 @@ def new_edges_by_commoneighbors_histogram(G_0, G_1):
         if e not in G_1.edges:  # means that edge was formed between t=-1 and t=0
             u = e[0]
             v = e[1]
-            common_num = len(set((nx.common_neighbors(G_1, u, v))))
+            common_num = len(set(G_1.neighbors(u)) & set(G_1.neighbors(v)) - {u, v})
             histogram[common_num] += 1
 
     # divide histogram values by total number of new edges between yesterday and today to form probability function
@@ -247,73 +285,151 @@ if __name__ == '__main__':
     artist_to_promote = 511147  # our artists are [144882, 194647, 511147, 532992]
     new_edges_method = prob_p_forall_index(0.001)
     finish_without_simulation = False  # if True the simulation itself will not run (time saving)
+    use_csr_engine = False  # if True G_0, hill climbing and the simulation run on the array-backed csr_graph engine
+    use_data_cache = False  # if True the inputs are loaded from binary snapshots of the csv files (see data_cache)
+    use_graph_overlay = False  # if True the simulated days are GraphOverlay layers over G_0 instead of nx.Graph copies
+    instrumentation_report = None  # path of a JSON report of per-stage times and counters (None - no instrumentation)
+    profile_stages = False  # if True (with instrumentation_report) every stage is also profiled with cProfile
+    batch_artists = None  # list of artists. if given, influencers of all of them are found on one simulated network
+    seed_selector = None  # function (G, k) -> S used instead of hill climbing, e.g. seed_selection.ris
+    # seed_selection.ris optimises a capped model: a node with h > 1000 buys with probability bt / nt in it instead of
+    # h * bt / (1000 * nt), so its estimates are low for artists with such plays and its seeds may be worse for them
+    refine_seconds = None  # if given, the influencers are refined by swaps (seed_selection.swap_local_search) this long
+    # the refined influencers are kept only if a Monte Carlo simulation on G_0 does not score them lower
 
     print(f"artist: {artist_to_promote}")
     print(f"new edges method: {new_edges_method.__name__}")
 
+    if instrumentation_report:
+        instrumentation.enable(output=instrumentation_report, profile=profile_stages)
+
     print("loading data...")
-    instaglam0, instaglam_1, spotifly = load_data()
+    instrumentation.start_stage("loading data")
+    instaglam0, instaglam_1, spotifly = data_cache.load_data() if use_data_cache else load_data()
 
     # build graphs
     print("building network...")
+    instrumentation.start_stage("building network")
     G_1 = build_graph(instaglam_1)  # graph at time=-1
-    G_0 = build_graph(instaglam0)  # graph at time=0
-    for n in G_0.nodes:  # initialization of properties foreach node
-        G_0.nodes[n]["buying probability"] = 0
-        G_0.nodes[n]["infected"] = False
-        G_0.nodes[n]["buying probability test"] = 0
-        G_0.nodes[n]["infected test"] = False
-        filt = (spotifly['userID'] == n) & (spotifly[' artistID'] == artist_to_promote)
-        G_0.nodes[n]["h"] = 0 if spotifly.loc[filt, '#plays'].empty else list(spotifly.loc[filt, '#plays'])[0]
+    plays = data_cache.load_play_counts() if use_data_cache else play_counts.PlayCounts(spotifly)
+    if use_csr_engine:
+        # graph at time=0
+        G_0 = data_cache.load_csr_graph('./instaglam0.csv') if use_data_cache else csr_graph.build_csr_graph(instaglam0)
+        G_0.h[:] = plays.h(G_0.nodes, artist_to_promote)
+    else:
+        G_0 = build_graph(instaglam0)  # graph at time=0
+        # initialization of properties foreach node (build_graph already set the others)
+        nx.set_node_attributes(G_0, dict(zip(G_0.nodes, plays.h(G_0.nodes, artist_to_promote).tolist())), name="h")
 
     # simulate creation of new edges in the graph
-    G_random = nx.Graph(G_0)
-    G_random_prev = nx.Graph(G_1)
+    if use_csr_engine:
+        G_random = G_0.copy()
+        G_random_prev = csr_graph.build_csr_graph(instaglam_1)
+    elif use_graph_overlay:
+        G_random = graph_overlay.GraphOverlay(G_0)  # new edges are layered over G_0 instead of copying it
+        G_random_prev = G_1
+    else:
+        G_random = nx.Graph(G_0)
+        G_random_prev = nx.Graph(G_1)
     histogram = None
+    common_neighbors_model = None
     if new_edges_method != prob_p_forall_index(0):
         print("simulating creation of new edges in the network...")
+        instrumentation.start_stage("simulating creation of new edges")
+        if use_csr_engine and new_edges_method == common_neighbors_index:
+            # the histogram of every day is counted from the edges formed on the day before
+            common_neighbors_model = edge_formation.CommonNeighborsModel(G_random, G_random_prev)
         for i in range(7):
             if new_edges_method != common_neighbors_index:
-                P = build_probabilities_dict(G_random, probability_function=new_edges_method)
+                P = build_probability_model(G_random, probability_function=new_edges_method)
+            else:
+                if use_csr_engine:
+                    histogram = common_neighbors_model.histogram()
+                else:
+                    histogram = new_edges_by_commoneighbors_histogram(G_0=G_random, G_1=G_random_prev)
+                P = build_probability_model(G_random, probability_function=common_neighbors_index, hist=histogram)
+                if use_graph_overlay and not use_csr_engine:
+                    G_random_prev, G_random = G_random, G_random.layer()  # yesterday is kept as it is
+                elif not use_csr_engine:
+                    G_random_prev = nx.Graph(G_random)
+            edges_before = G_random.number_of_edges()
+            if common_neighbors_model is not None:
+                common_neighbors_model.add_edges(*edge_formation.sample_new_edges(G_random, P))
+            elif use_csr_engine:
+                G_random.add_edges_from(*edge_formation.sample_new_edges(G_random, P))
             else:
-                histogram = new_edges_by_commoneighbors_histogram(G_0=G_random, G_1=G_random_prev)
-                P = build_probabilities_dict(G_random, probability_function=common_neighbors_index, hist=histogram)
-                G_random_prev = nx.Graph(G_random)
-            add_new_edges(G_random, P)
+                add_new_edges(G_random, P)
+            instrumentation.append("simulated edges added per day", G_random.number_of_edges() - edges_before)
+
+    if batch_artists:
+        print("finding influencers for all artists...")
+        instrumentation.start_stage("finding influencers")
+        G_random_csr = G_random if use_csr_engine else csr_graph.from_networkx(G_random)
+        seed_sets = csr_graph.batch_hill_climbing(G_random_csr, 5, plays.h_matrix(G_random_csr.nodes, batch_artists))
+        for artist, influencers in zip(batch_artists, seed_sets):
+            print(f"artist: {artist} influencers: {influencers}")
+        exit("Finished batch influencers search")
 
     print("finding influencers...")
+    instrumentation.start_stage("finding influencers")
     # find influencers by running HC on the simulated graph
-    influencers = hill_climbing(G_random, 5)
+    if seed_selector is not None:
+        influencers = seed_selector(G_random, 5)
+    elif use_csr_engine:
+        influencers = csr_graph.hill_climbing(G_random, 5, lazy=True)
+    else:
+        influencers = hill_climbing(G_random, 5)
+    if refine_seconds is not None:
+        verify = seed_selection.monte_carlo_objective(csr_graph.as_csr_graph(G_0))
+        influencers = seed_selection.swap_local_search(G_random, influencers, time_budget=refine_seconds, verify=verify)
     print(f"influencers: {influencers}")
 
     infected_cnt = 5
-    for influencer in influencers:
-        G_0.nodes[influencer]["infected"] = True
+    if use_csr_engine:
+        G_0.infected[G_0.index_of(influencers)] = True
+    else:
+        for influencer in influencers:
+            G_0.nodes[influencer]["infected"] = True
 
     if finish_without_simulation:
         exit("Finished without simulating")
 
     # simulation:
     print("simulation...")
+    instrumentation.start_stage("simulation")
     # calc buying probability at time=0
-    calc_buying_probability(G_0, G_0.nodes)
+    if use_csr_engine:
+        tracker = csr_graph.BuyingProbabilityTracker(G_0)  # keeps the probabilities up to date from now on
+    else:
+        calc_buying_probability(G_0, G_0.nodes)
 
     # start simulation on network at time=0, do 6 iterations
     for t in range(1, 7):
         # check foreach node if it got infected
-        for node in G_0.nodes:
-            u = random.random()
-            if G_0.nodes[node]["buying probability"] > u and G_0.nodes[node]["infected"] is False:
-                G_0.nodes[node]["infected"] = True
-                infected_cnt += 1
+        if use_csr_engine:
+            infected_cnt += csr_graph.frontier_infection_step(G_0, tracker)
+        else:
+            for node in G_0.nodes:
+                u = random.random()
+                if G_0.nodes[node]["buying probability"] > u and G_0.nodes[node]["infected"] is False:
+                    G_0.nodes[node]["infected"] = True
+                    infected_cnt += 1
+            instrumentation.count("random draws", G_0.number_of_nodes())
         print(f"infected at time {t}: {infected_cnt}")
         # add new edges to graph according probability function
         if t < 6:
-            # build probabilities dict at time=t
+            # build probabilities model at time=t
             if new_edges_method != common_neighbors_index:
-                P = build_probabilities_dict(G_0, probability_function=new_edges_method)
+                P = build_probability_model(G_0, probability_function=new_edges_method)
+            else:
+                # G_0 has the nodes of G_random, so the simulated network is not used (nor changed) any more
+                P = build_probability_model(G_0, probability_function=common_neighbors_index, hist=histogram)
+            edges_before = G_0.number_of_edges()
+            if use_csr_engine:
+                # buying probability at time=t is updated with the new edges
+                tracker.add_edges(*edge_formation.sample_new_edges(G_0, P))
             else:
-                P = build_probabilities_dict(G_random, probability_function=common_neighbors_index, hist=histogram)
-            add_new_edges(G_0, P)
-            # calc buying probability at time=t
-            calc_buying_probability(G_0, G_0.nodes)
+                add_new_edges(G_0, P)
+                # calc buying probability at time=t
+                calc_buying_probability(G_0, G_0.nodes)
+            instrumentation.append("edges added per day", G_0.number_of_edges() - edges_before)
@@ -0,0 +1,222 @@
+import importlib
+import json
+import platform
+import subprocess
+import time
+
+import networkx as nx
+import numpy as np
+import pandas as pd
+
+import csr_graph
+import edge_formation
+import graph_overlay
+from play_counts import PlayCounts
+
+main = importlib.import_module('206574733_208634469')
+
+
+def synthetic_data(n, m=5, degree_model='barabasi_albert', new_edges_fraction=0.1, plays_fraction=0.1, artist=1,
+                   seed=0):
+    """
+    generate inputs shaped like the bundled csv files, at any size
+    :param n: number of users
+    :param m: edges per new node (barabasi_albert) or average degree / 2 (erdos_renyi)
+    :param degree_model: 'barabasi_albert' (power law degrees) or 'erdos_renyi' (binomial degrees)
+    :param new_edges_fraction: fraction of today's edges missing from the "yesterday" snapshot. an edge is removed
+                               only if both its nodes keep at least one friend, so both snapshots have the same users.
+    :param plays_fraction: fraction of users that played the artist
+    :param artist: artistID of the synthetic play counts
+    :param seed: random seed
+    :return: instaglam0, instaglam_1, spotifly DataFrames (same columns as load_data)
+    """
+    rng = np.random.default_rng(seed)
+    if degree_model == 'barabasi_albert':
+        G = nx.barabasi_albert_graph(n, m, seed=seed)
+    elif degree_model == 'erdos_renyi':
+        G = nx.fast_gnp_random_graph(n, 2 * m / max(n - 1, 1), seed=seed)
+    else:
+        raise ValueError(f"unknown degree model {degree_model}")
+    G.remove_nodes_from([v for v in list(G.nodes) if G.degree(v) == 0])
+    ids = rng.choice(1000000 if n < 500000 else 10 * n, size=n, replace=False)
+    edges = np.array(list(G.edges), dtype=np.int64).reshape(-1, 2)
+    instaglam0 = pd.DataFrame({'userID': ids[edges[:, 0]], 'friendID': ids[edges[:, 1]]})
+
+    degrees = np.bincount(edges.ravel(), minlength=n)
+    keep = np.ones(len(edges), dtype=bool)
+    for e in rng.permutation(len(edges))[:int(new_edges_fraction * len(edges))].tolist():
+        u, v = edges[e]
+        if degrees[u] > 1 and degrees[v] > 1:
+            keep[e] = False
+            degrees[u] -= 1
+            degrees[v] -= 1
+    instaglam_1 = instaglam0[keep].reset_index(drop=True)
+
+    users = np.union1d(instaglam0['userID'].values, instaglam0['friendID'].values)
+    players = rng.choice(users, size=int(plays_fraction * len(users)), replace=False)
+    spotifly = pd.DataFrame({'userID': np.sort(players), ' artistID': artist,
+                             '#plays': rng.geometric(1 / 300, size=len(players))})
+    return instaglam0, instaglam_1, spotifly
+
+
+def _time(stage, engine, function, repeat, results, info):
+    """
+    time one stage (best of repeat runs) and append a result row
+    :return: the value returned by the last run of function
+    """
+    seconds = []
+    value = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        value = function()
+        seconds.append(time.perf_counter() - start)
+    results.append(dict(info, stage=stage, engine=engine, seconds=min(seconds), repeat=repeat))
+    return value
+
+
+def run_benchmarks(instaglam0, instaglam_1, spotifly, artist, dataset, k=5, repeat=3, all_pairs_limit=3000,
+                   seed=0):
+    """
+    time every stage of the pipeline separately, for the networkx functions of the main script and for their
+    array-backed counterparts. add_new_edges is also timed on a GraphOverlay of G_0 (engine 'overlay'). stages that
+    visit all pairs of nodes are skipped above all_pairs_limit nodes.
+    :param instaglam0: friendships today (pd.Dataframe)
+    :param instaglam_1: friendships yesterday (pd.Dataframe)
+    :param spotifly: play counts (pd.Dataframe)
+    :param artist: promoted artist
+    :param dataset: name of the inputs in the results
+    :param k: number of influencers for IC and hill_climbing
+    :param repeat: runs per stage (the best one is reported)
+    :param all_pairs_limit: maximal number of nodes for the all-pairs stages
+    :param seed: random seed
+    :return: list of result rows (dicts)
+    """
+    random_state = np.random.default_rng(seed)
+    results = []
+    G_0 = _time('build_graph', 'networkx', lambda: main.build_graph(instaglam0), repeat, results, {})
+    info = {'dataset': dataset, 'nodes': G_0.number_of_nodes(), 'edges': G_0.number_of_edges()}
+    results = [dict(info, **row) for row in results]
+    G_1 = main.build_graph(instaglam_1)
+    H_0 = _time('build_graph', 'csr', lambda: csr_graph.build_csr_graph(instaglam0), repeat, results, info)
+    H_1 = csr_graph.build_csr_graph(instaglam_1)
+
+    H_0.h[:] = PlayCounts(spotifly).h(H_0.nodes, artist)
+    nx.set_node_attributes(G_0, dict(zip(H_0.nodes.tolist(), H_0.h.tolist())), name="h")
+    S = set(random_state.choice(H_0.ids, size=k, replace=False).tolist())
+    nx.set_node_attributes(G_0, {n: n in S for n in G_0.nodes}, name="infected")
+    H_0.infected[H_0.index_of(S)] = True
+
+    main.G_0, main.G_1 = G_0, G_1  # the probability functions of the main script read these globals
+    if G_0.number_of_nodes() <= all_pairs_limit:
+        P = _time('build_probabilities_dict', 'networkx',
+                  lambda: main.build_probabilities_dict(G_0, main.friendly_index), repeat, results, info)
+        _time('add_new_edges', 'networkx', lambda: main.add_new_edges(nx.Graph(G_0), P), repeat, results, info)
+        _time('add_new_edges', 'overlay', lambda: main.add_new_edges(graph_overlay.GraphOverlay(G_0), P),
+              repeat, results, info)
+    model = _time('build_probabilities_dict', 'csr',
+                  lambda: edge_formation.friendly_index_probabilities(H_0.ids, H_0, H_1), repeat, results, info)
+    _time('add_new_edges', 'csr', lambda: edge_formation.sample_new_edges(H_0, model, random_state),
+          repeat, results, info)
+
+    _time('calc_buying_probability', 'networkx', lambda: main.calc_buying_probability(G_0, G_0.nodes),
+          repeat, results, info)
+    _time('calc_buying_probability', 'csr', lambda: csr_graph.calc_buying_probability(H_0, H_0.nodes),
+          repeat, results, info)
+    _time('IC', 'networkx', lambda: main.IC(S, G_0), repeat, results, info)
+    _time('IC', 'csr', lambda: csr_graph.IC(S, H_0), repeat, results, info)
+    if G_0.number_of_nodes() <= all_pairs_limit:
+        _time('hill_climbing', 'networkx', lambda: main.hill_climbing(G_0, k), 1, results, info)
+    _time('hill_climbing', 'csr', lambda: csr_graph.hill_climbing(H_0, k, lazy=True), repeat, results, info)
+    return results
+
+
+def compare_friendly_index(instaglam0, instaglam_1, settings=((64, 32), (128, 64), (256, 128)), threshold=0.1,
+                           seed=0):
+    """
+    compare the MinHash/LSH approximation of friendly_index with the exact probabilities, on the pairs whose exact
+    chance to meet is at least threshold (the pairs the approximation is meant to find)
+    :param instaglam0: friendships today (pd.Dataframe)
+    :param instaglam_1: friendships yesterday (pd.Dataframe)
+    :param settings: (signature length, number of bands) pairs to compare
+    :param threshold: minimal chance to meet of the approximation
+    :param seed: random seed
+    :return: list of result rows (dicts): recall and precision of the pairs found, mean absolute error of their
+             probabilities and of their chance to meet, and the approximated share of the exact probability mass
+    """
+    G_0 = csr_graph.build_csr_graph(instaglam0)
+    G_1 = csr_graph.build_csr_graph(instaglam_1)
+    start = time.perf_counter()
+    exact = edge_formation.friendly_index_probabilities(G_0.ids, G_0, G_1)
+    exact_seconds = time.perf_counter() - start
+    n = len(G_0.ids)
+    rows, cols, intersection = edge_formation.common_neighbor_pairs(G_0.ids, G_1)
+    keys = edge_formation._pair_keys(rows, cols, n)
+    order = np.argsort(keys)  # same order as exact.keys
+    degree_1 = G_1.degrees[G_1.index_of(G_0.ids)]
+    chance_to_meet = (intersection / (degree_1[rows] + degree_1[cols] - intersection))[order]
+    similar = chance_to_meet >= threshold
+    friendly = (G_0.degrees - degree_1) / G_0.degrees
+    results = []
+    for num_hashes, bands in settings:
+        start = time.perf_counter()
+        approximate = edge_formation.friendly_index_minhash_probabilities(G_0.ids, G_0, G_1, num_hashes, bands,
+                                                                          threshold, np.random.default_rng(seed))
+        seconds = time.perf_counter() - start
+        found = np.isin(exact.keys, approximate.keys)
+        position = np.searchsorted(exact.keys, approximate.keys)
+        friendly_sum = friendly[approximate.keys // n] + friendly[approximate.keys % n]
+        defined = friendly_sum != 0  # the chance to meet of the other pairs is not recoverable from the probability
+        approximate_chance = approximate.values[defined] / friendly_sum[defined]
+        exact_chance = chance_to_meet[position][defined]
+        results.append({'signature length': num_hashes, 'bands': bands, 'threshold': threshold,
+                        'exact pairs': int(similar.sum()), 'approximate pairs': len(approximate.keys),
+                        'recall': float((found & similar).sum() / max(similar.sum(), 1)),
+                        'precision': float(similar[position].sum() / max(len(position), 1)),
+                        'probability mae': float(np.abs(approximate.values - exact.values[position]).mean()),
+                        'chance to meet mae': float(np.abs(approximate_chance - exact_chance).mean()),
+                        'probability mass': float(approximate.values.sum() / exact.values[similar].sum()),
+                        'seconds': seconds, 'exact seconds': exact_seconds})
+    return results
+
+
+def _version():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == '__main__':
+
+    # input variables: edit these vars
+    artist = 511147  # artist of the bundled data
+    synthetic_sizes = [2000, 20000]  # number of users of every synthetic graph
+    degree_model = 'barabasi_albert'  # 'barabasi_albert' or 'erdos_renyi'
+    edges_per_node = 5
+    k = 5
+    repeat = 3
+    output_file = './benchmark_results.json'
+    minhash_settings = [(64, 32), (128, 64), (256, 128)]  # (signature length, bands) of the friendly_index comparison
+    minhash_threshold = 0.1
+
+    results = []
+    print("benchmarking bundled data...")
+    instaglam0, instaglam_1, spotifly = main.load_data()
+    results += run_benchmarks(instaglam0, instaglam_1, spotifly, artist, 'instaglam', k, repeat)
+    for n in synthetic_sizes:
+        print(f"benchmarking synthetic graph with {n} users...")
+        instaglam0, instaglam_1, spotifly = synthetic_data(n, edges_per_node, degree_model, artist=artist)
+        results += run_benchmarks(instaglam0, instaglam_1, spotifly, artist, f"{degree_model}_{n}", k, repeat)
+
+    print("comparing approximate friendly_index with the exact one...")
+    instaglam0, instaglam_1, spotifly = main.load_data()
+    minhash = compare_friendly_index(instaglam0, instaglam_1, minhash_settings, minhash_threshold)
+
+    report = {'version': _version(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': platform.python_version(),
+              'numpy': np.__version__, 'networkx': nx.__version__, 'results': results,
+              'friendly_index_minhash': minhash}
+    with open(output_file, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(pd.DataFrame(results).to_string(index=False))
+    print(pd.DataFrame(minhash).to_string(index=False))
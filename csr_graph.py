@@ -0,0 +1,530 @@
+import heapq
+import multiprocessing
+import random
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import scipy.sparse as sp
+
+import instrumentation
+
+
+class CSRGraph:
+    """
+    Compact array-backed undirected graph.
+    userIDs are remapped to dense int32 indices (ids[i] is the userID of index i, ids is sorted), the neighbors of index
+    i are indices[indptr[i]:indptr[i + 1]] and every node attribute of build_graph is kept in a numpy array indexed the
+    same way instead of a networkx attribute dict.
+    The graph exposes the small part of the nx.Graph interface used by the probability functions (nodes, degree,
+    neighbors, has_edge, number_of_nodes) so it can be passed wherever those only read the graph.
+    """
+
+    def __init__(self, ids, rows, cols):
+        """
+        :param ids: sorted array of userIDs
+        :param rows: first endpoint of every edge (dense indices)
+        :param cols: second endpoint of every edge (dense indices). duplicate edges and orientation are ignored.
+        """
+        self.ids = np.asarray(ids, dtype=np.int64)
+        n = len(self.ids)
+        # node attributes. test attributes are used in calculations of IC
+        self.buying_probability = np.zeros(n, dtype=np.float64)
+        self.infected = np.zeros(n, dtype=bool)
+        self.buying_probability_test = np.zeros(n, dtype=np.float64)
+        self.infected_test = np.zeros(n, dtype=bool)
+        self.h = np.zeros(n, dtype=np.int64)
+        self._set_edges(np.asarray(rows, dtype=np.int64), np.asarray(cols, dtype=np.int64))
+
+    def _set_edges(self, rows, cols):
+        """
+        build the CSR arrays from an edge list in bulk
+        :param rows: first endpoint of every edge (dense indices)
+        :param cols: second endpoint of every edge (dense indices)
+        :return: None
+        """
+        n = len(self.ids)
+        lo = np.minimum(rows, cols)
+        hi = np.maximum(rows, cols)
+        keys = np.sort(lo * n + hi)  # canonical (min, max) pairs
+        keys = keys[np.concatenate([[True], keys[1:] != keys[:-1]])] if len(keys) else keys  # without duplicates
+        lo, hi = keys // n, keys % n
+        src = np.concatenate([lo, hi])
+        dst = np.concatenate([hi, lo])
+        order = np.lexsort((dst, src))  # neighbors of every node are sorted
+        self.indices = dst[order].astype(np.int32)
+        self.degrees = np.bincount(src, minlength=n).astype(np.int64)
+        self.indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(self.degrees, out=self.indptr[1:])
+        self._adjacency = None
+
+    def adjacency_matrix(self):
+        """
+        :return: sparse 0/1 adjacency matrix (scipy.sparse.csr_matrix) sharing the CSR arrays of the graph
+        """
+        if self._adjacency is None:
+            n = len(self.ids)
+            data = np.ones(len(self.indices), dtype=np.int64)
+            self._adjacency = sp.csr_matrix((data, self.indices, self.indptr), shape=(n, n))
+        return self._adjacency
+
+    def edge_arrays(self):
+        """
+        :return: (rows, cols) dense indices of every edge once, with rows <= cols (a self loop, stored as a doubled
+                 neighbor entry, is returned once)
+        """
+        src = np.repeat(np.arange(len(self.ids), dtype=np.int64), self.degrees)
+        dst = self.indices.astype(np.int64)
+        mask = src < dst
+        mask[np.flatnonzero(src == dst)[::2]] = True  # the two entries of a self loop are adjacent in its sorted row
+        return src[mask], dst[mask]
+
+    def add_edges_from(self, rows, cols):
+        """
+        insert edges in bulk. the rows of the CSR arrays are sorted, so the (row, neighbor) keys of the graph are one
+        sorted array and the entries of the batch are merged into it at their searchsorted positions: the batch is
+        sorted, the existing arrays are only copied once (O(|V| + |E| + b log b) for a batch of b edges).
+        :param rows: first endpoint of every new edge (dense indices)
+        :param cols: second endpoint of every new edge (dense indices). duplicate edges and orientation are ignored.
+        :return: None
+        """
+        n = len(self.ids)
+        rows = np.asarray(rows, dtype=np.int64)
+        cols = np.asarray(cols, dtype=np.int64)
+        old_keys = np.repeat(np.arange(n, dtype=np.int64), self.degrees) * n + self.indices
+        keys = np.unique(np.minimum(rows, cols) * n + np.maximum(rows, cols))
+        keys = keys[np.searchsorted(old_keys, keys) == np.searchsorted(old_keys, keys, side='right')]  # not in G
+        if not len(keys):
+            return
+        lo, hi = keys // n, keys % n
+        new_keys = np.sort(np.concatenate([lo * n + hi, hi * n + lo]))  # a self loop is a doubled entry
+        positions = np.searchsorted(old_keys, new_keys) + np.arange(len(new_keys))
+        is_new = np.zeros(len(old_keys) + len(new_keys), dtype=bool)
+        is_new[positions] = True
+        indices = np.empty(len(is_new), dtype=np.int32)
+        indices[positions] = new_keys % n
+        indices[~is_new] = self.indices
+        self.indices = indices
+        self.degrees = self.degrees + np.bincount(new_keys // n, minlength=n)
+        self.indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(self.degrees, out=self.indptr[1:])
+        self._adjacency = None
+
+    def index_of(self, nodes):
+        """
+        :param nodes: a userID or an iterable of userIDs
+        :return: dense index (or int64 array of indices) of the given userIDs
+        """
+        scalar = np.isscalar(nodes)
+        nodes = np.asarray([nodes] if scalar else list(nodes), dtype=np.int64)
+        idx = np.searchsorted(self.ids, nodes)
+        found = idx < len(self.ids)
+        found[found] = self.ids[idx[found]] == nodes[found]
+        if not found.all():
+            raise KeyError(f"nodes {nodes[~found].tolist()} are not in the graph")
+        return int(idx[0]) if scalar else idx
+
+    def neighbor_indices(self, i):
+        """
+        :param i: dense index of a node
+        :return: dense indices of the neighbors of i
+        """
+        return self.indices[self.indptr[i]:self.indptr[i + 1]]
+
+    @property
+    def nodes(self):
+        return self.ids
+
+    def number_of_nodes(self):
+        return len(self.ids)
+
+    def number_of_edges(self):
+        return len(self.indices) // 2
+
+    def degree(self, n):
+        return int(self.degrees[self.index_of(n)])
+
+    def neighbors(self, n):
+        return iter(self.ids[self.neighbor_indices(self.index_of(n))])
+
+    def has_edge(self, u, v):
+        i, j = self.index_of(u), self.index_of(v)
+        neighbors = self.neighbor_indices(i)
+        pos = np.searchsorted(neighbors, j)
+        return bool(pos < len(neighbors) and neighbors[pos] == j)
+
+    @classmethod
+    def from_arrays(cls, ids, indptr, indices):
+        """
+        :param ids: sorted array of userIDs
+        :param indptr: CSR row pointers (both directions of every edge, sorted neighbors)
+        :param indices: CSR neighbor indices
+        :return: CSRGraph over the given (possibly memory-mapped) arrays with fresh node attributes
+        """
+        G = cls.__new__(cls)
+        G.ids = ids
+        n = len(ids)
+        G.buying_probability = np.zeros(n, dtype=np.float64)
+        G.infected = np.zeros(n, dtype=bool)
+        G.buying_probability_test = np.zeros(n, dtype=np.float64)
+        G.infected_test = np.zeros(n, dtype=bool)
+        G.h = np.zeros(n, dtype=np.int64)
+        G.indptr, G.indices = indptr, indices
+        G.degrees = np.diff(indptr)
+        G._adjacency = None
+        return G
+
+    def copy(self):
+        """
+        :return: a new CSRGraph with the same edges and node attributes
+        """
+        H = CSRGraph.from_arrays(self.ids, self.indptr, self.indices)  # edge arrays are replaced, never mutated
+        H._adjacency = self._adjacency
+        H.buying_probability = self.buying_probability.copy()
+        H.infected = self.infected.copy()
+        H.buying_probability_test = self.buying_probability_test.copy()
+        H.infected_test = self.infected_test.copy()
+        H.h = self.h.copy()
+        return H
+
+
+def build_csr_graph(instaglam):
+    """
+    build network graph in bulk from the friendships DataFrame (same graph as build_graph, array-backed)
+    :param instaglam: description of friendships between members in the network (pd.Dataframe)
+    :return: network graph (CSRGraph)
+    """
+    users = instaglam['userID'].values
+    friends = instaglam['friendID'].values
+    ids = np.union1d(users, friends)
+    return CSRGraph(ids, np.searchsorted(ids, users), np.searchsorted(ids, friends))
+
+
+def from_networkx(G):
+    """
+    convert a graph built by build_graph (with its node attributes) to a CSRGraph
+    :param G: network graph (nx.Graph)
+    :return: network graph (CSRGraph)
+    """
+    ids = np.array(sorted(G.nodes), dtype=np.int64)
+    edges = np.array(list(G.edges), dtype=np.int64).reshape(-1, 2)
+    H = CSRGraph(ids, np.searchsorted(ids, edges[:, 0]), np.searchsorted(ids, edges[:, 1]))
+    for i, n in enumerate(ids.tolist()):
+        attributes = G.nodes[n]
+        H.buying_probability[i] = attributes.get("buying probability", 0)
+        H.infected[i] = attributes.get("infected", False)
+        H.buying_probability_test[i] = attributes.get("buying probability test", 0)
+        H.infected_test[i] = attributes.get("infected test", False)
+        H.h[i] = attributes.get("h", 0)
+    return H
+
+
+def as_csr_graph(G):
+    """
+    :param G: network graph (nx.Graph or CSRGraph)
+    :return: G itself if it is a CSRGraph, else its conversion
+    """
+    return G if isinstance(G, CSRGraph) else from_networkx(G)
+
+
+def _buying_probability(h, bt, nt):
+    """
+    the buying probability formula of calc_buying_probability, for arrays
+    :param h: h of every node (np.array)
+    :param bt: number of infected friends of every node (np.array)
+    :param nt: degree of every node (np.array)
+    :return: np.array of the buying probabilities
+    """
+    return np.where(h == 0, bt / nt, (h * bt) / (1000 * nt))
+
+
+def calc_buying_probability(G, nodes_group, test_flag=False, batched=True):
+    """
+    For each node in nodes_group, calculate and update the probability that it will buy the product according to
+    the given formula.
+    In batched mode the number of infected friends of the whole group is one sparse adjacency x infected-mask product
+    and the formula is applied with numpy. The result is identical to the per node calculation (bt is an exact integer
+    count and both paths divide the same integers in float64).
+    :param G: network graph (CSRGraph)
+    :param nodes_group: set of nodes (userIDs) for which we would like to find the buying probability
+    :param test_flag: boolean. True if the calculation is done for IC calculation, else False.
+    :param batched: boolean. True to calculate the whole group at once, False to calculate node by node.
+    :return: None (only updating attributes of nodes)
+    """
+    infected = G.infected_test if test_flag else G.infected
+    buying_probability = G.buying_probability_test if test_flag else G.buying_probability
+    idx = G.index_of(nodes_group)
+    instrumentation.count("neighbor visits", G.degrees[idx].sum())
+    if batched:
+        bt = G.adjacency_matrix()[idx] @ infected.astype(np.int64)
+        nt = G.degrees[idx]
+        h = G.h[idx]
+        buying_probability[idx] = _buying_probability(h, bt, nt)
+        return
+    for i in idx.tolist():
+        nt = int(G.degrees[i])
+        h = int(G.h[i])
+        bt = int(np.count_nonzero(infected[G.neighbor_indices(i)]))
+        if h == 0:
+            buying_probability[i] = bt / nt
+        else:
+            buying_probability[i] = ((h * bt) / (1000 * nt))
+
+
+class BuyingProbabilityTracker:
+    """
+    Keeps the buying probabilities of G up to date incrementally during the simulation, instead of calling
+    calc_buying_probability on all nodes after every day. The number of infected friends (bt) of every node is kept
+    as a counter: when nodes get infected only their friends change, and when an edge is added only its two
+    endpoints change, so only those probabilities are recomputed. The values are identical to a full recompute.
+    Inserting a day's edges still copies the CSR arrays of G once (CSRGraph.add_edges_from), so that part of a day
+    costs O(|V| + |E|), without sorting the existing edges again.
+    The tracker also keeps the frontier: the nodes that are not infected and have a nonzero buying probability, the
+    only nodes that can get infected in the next timestep (see frontier_infection_step).
+    """
+
+    def __init__(self, G):
+        """
+        :param G: network graph (CSRGraph). its buying probabilities are calculated once here.
+        """
+        self.G = G
+        self.bt = G.adjacency_matrix() @ G.infected.astype(np.int64)
+        self.frontier = set()
+        self._update(np.arange(len(G.ids)))
+
+    def _update(self, idx):
+        """
+        recompute the buying probability of the given nodes from the counters
+        """
+        G = self.G
+        idx = np.unique(idx)
+        instrumentation.count("buying probability updates", len(idx))
+        nt = G.degrees[idx]
+        h = G.h[idx]
+        bt = self.bt[idx]
+        G.buying_probability[idx] = _buying_probability(h, bt, nt)
+        susceptible = (G.buying_probability[idx] > 0) & ~G.infected[idx]
+        self.frontier.update(idx[susceptible].tolist())
+        self.frontier.difference_update(idx[~susceptible].tolist())
+
+    def infect(self, idx):
+        """
+        mark nodes as infected and update the probabilities of their friends
+        :param idx: dense indices of the newly infected nodes
+        :return: None
+        """
+        G = self.G
+        idx = np.asarray(idx, dtype=np.int64)
+        idx = np.unique(idx[~G.infected[idx]])
+        if not len(idx):
+            return
+        G.infected[idx] = True
+        self.frontier.difference_update(idx.tolist())
+        friends = np.concatenate([G.neighbor_indices(i) for i in idx.tolist()])
+        instrumentation.count("neighbor visits", len(friends))
+        np.add.at(self.bt, friends, 1)
+        self._update(friends)
+
+    def add_edges(self, rows, cols):
+        """
+        insert new edges to G (use instead of G.add_edges_from) and update the probabilities of their endpoints
+        :param rows: first endpoint of every new edge (dense indices)
+        :param cols: second endpoint of every new edge (dense indices). the pairs must not be edges of G yet and must
+                     not repeat, like the output of edge_formation.sample_new_edges.
+        :return: None
+        """
+        G = self.G
+        rows = np.asarray(rows, dtype=np.int64)
+        cols = np.asarray(cols, dtype=np.int64)
+        if not len(rows):
+            return
+        G.add_edges_from(rows, cols)
+        np.add.at(self.bt, rows, G.infected[cols].astype(np.int64))
+        np.add.at(self.bt, cols, G.infected[rows].astype(np.int64))
+        self._update(np.concatenate([rows, cols]))
+
+
+def IC(S, G):
+    """
+    influence cone algorithm
+    :param S: set of nodes (userIDs)
+    :param G: graph (CSRGraph)
+    :return: influence cone rank of S
+    """
+    instrumentation.count("IC calls")
+    influence_cone = len(S)
+    S_idx = G.index_of(S)
+    G.infected_test[S_idx] = True
+    if len(S_idx):
+        neighbors_of_S = np.unique(np.concatenate([G.neighbor_indices(s) for s in S_idx.tolist()]))
+    else:
+        neighbors_of_S = np.zeros(0, dtype=np.int64)
+    calc_buying_probability(G, G.ids[neighbors_of_S], test_flag=True)
+    influence_cone += G.buying_probability_test[neighbors_of_S].sum()
+    G.infected_test[S_idx] = False  # clean attribute for the next runs
+    return influence_cone
+
+
+def _best_candidate(G, S, IC_S, candidates):
+    """
+    helper function for hill_climbing. scan the candidates in the given order and find the one with the maximal
+    marginal contribution to IC (the first one on ties).
+    :param G: network graph (CSRGraph)
+    :param S: current set of influencers
+    :param IC_S: IC(S, G)
+    :param candidates: userIDs to check
+    :return: (max marginal contribution, its userID)
+    """
+    argmax_mv = None
+    max_mv = -1
+    for v in candidates:
+        S.add(v)
+        IC_Sv = IC(S, G)
+        S.remove(v)
+        mv = IC_Sv - IC_S
+        if mv > max_mv:
+            max_mv = mv
+            argmax_mv = v
+    return max_mv, argmax_mv
+
+
+_worker_graph = None  # graph of a hill_climbing pool worker
+
+
+def _init_worker(G):
+    """
+    pool initializer. with the fork start method G is inherited from the parent and is not copied per task.
+    :param G: network graph (CSRGraph)
+    :return: None
+    """
+    global _worker_graph
+    _worker_graph = G
+
+
+def _best_candidate_in_worker(S, IC_S, candidates):
+    return _best_candidate(_worker_graph, set(S), IC_S, candidates)
+
+
+def hill_climbing(G, k, lazy=False, processes=None):
+    """
+    Algorithm to find k influencers in graph G. candidates are scanned by ascending userID, so ties are broken in
+    favor of the smallest userID.
+    :param G: network graph (CSRGraph)
+    :param k: number of wanted influencers
+    :param lazy: boolean. True to use the CELF lazy-greedy selection (same seed set, far fewer evaluations).
+    :param processes: number of worker processes for the candidates scan of every round (None or 1 - serial).
+                      the candidates are split to contiguous shards, so the result is identical to the serial one.
+    :return: set S of k influencers
+    """
+    if lazy:
+        return lazy_hill_climbing(G, k)
+    S = set()
+    if processes is None or processes <= 1:
+        for i in range(k):
+            S.add(_best_candidate(G, S, IC(S, G), [v for v in G.ids.tolist() if v not in S])[1])
+        return S
+    context = multiprocessing.get_context("fork" if "fork" in multiprocessing.get_all_start_methods() else "spawn")
+    with ProcessPoolExecutor(processes, mp_context=context, initializer=_init_worker, initargs=(G,)) as pool:
+        for i in range(k):
+            IC_S = IC(S, G)
+            candidates = [v for v in G.ids.tolist() if v not in S]
+            shard_size = -(-len(candidates) // (4 * processes))
+            shards = [candidates[j:j + shard_size] for j in range(0, len(candidates), shard_size)]
+            results = pool.map(_best_candidate_in_worker, [list(S)] * len(shards), [IC_S] * len(shards), shards)
+            argmax_mv = None
+            max_mv = -1
+            for mv, v in results:  # shards are in scan order, so this is the serial argmax
+                if mv > max_mv:
+                    max_mv = mv
+                    argmax_mv = v
+            S.add(argmax_mv)
+    return S
+
+
+def _buying_probability_deltas(G, bt, idx=None):
+    """
+    helper function for lazy_hill_climbing. for each node n, the increase of its IC term (buying probability test)
+    when one more of its friends joins S.
+    :param G: network graph (CSRGraph)
+    :param bt: number of friends of each node that are in S (np.array)
+    :param idx: dense indices of the nodes to compute (None - all nodes)
+    :return: np.array of the increments of the nodes of idx
+    """
+    if idx is None:
+        nt, h = G.degrees, G.h
+    else:
+        nt, h, bt = G.degrees[idx], G.h[idx], bt[idx]
+    return _buying_probability(h, bt + 1, nt) - _buying_probability(h, bt, nt)
+
+
+def lazy_hill_climbing(G, k):
+    """
+    CELF lazy-greedy version of hill_climbing.
+    The marginal gain of v is IC(S + v) - IC(S) = 1 + the increase of the buying probability of v's friends, so it
+    is computed from v's neighborhood only, given how many friends in S every node already has (bt). Gains only
+    decrease as S grows, so candidates are kept in a max-heap of (possibly stale) gains and a candidate is re-evaluated
+    only when it reaches the top of the heap. Ties are broken in favor of the smallest userID, like hill_climbing.
+    :param G: network graph (CSRGraph)
+    :param k: number of wanted influencers
+    :return: set S of k influencers
+    """
+    bt = np.zeros(len(G.ids), dtype=np.int64)
+    deltas = _buying_probability_deltas(G, bt)
+    heap = [(-(1 + deltas[G.neighbor_indices(v)].sum()), v, 0) for v in range(len(G.ids))]
+    heapq.heapify(heap)
+    S = []
+    while len(S) < k and heap:
+        neg_mv, v, evaluated_at = heapq.heappop(heap)
+        if evaluated_at == len(S):  # gain is up to date, so it is the maximal one
+            S.append(v)
+            friends = G.neighbor_indices(v)
+            bt[friends] += 1
+            deltas[friends] = _buying_probability_deltas(G, bt, friends)
+        else:
+            instrumentation.count("marginal gain evaluations")
+            heapq.heappush(heap, (-(1 + deltas[G.neighbor_indices(v)].sum()), v, len(S)))
+    return set(G.ids[S].tolist())
+
+
+def batch_hill_climbing(G, k, H):
+    """
+    hill_climbing for several artists at once on the same graph. the artists differ only in their h values, so the
+    marginal gains of all candidates for all artists are one sparse adjacency x |V| x A matrix product per round, and
+    the neighbor structure of G is shared by all of them. Ties are broken in favor of the smallest userID, like
+    hill_climbing.
+    :param G: network graph (CSRGraph). its own h is ignored.
+    :param k: number of wanted influencers per artist
+    :param H: |V| x A np.array, H[i, a] is the h of node i (G.ids order) for artist a
+    :return: list of A sets of k influencers, one per artist
+    """
+    H = np.asarray(H, dtype=np.int64).reshape(len(G.ids), -1)
+    nt = G.degrees[:, None]
+    bt = np.zeros(H.shape, dtype=np.int64)
+    A = G.adjacency_matrix().astype(np.float64)
+    chosen = np.zeros(H.shape, dtype=bool)
+    S = [[] for _ in range(H.shape[1])]
+    columns = np.arange(H.shape[1])
+    for i in range(min(k, len(G.ids))):
+        deltas = _buying_probability(H, bt + 1, nt) - _buying_probability(H, bt, nt)
+        gains = 1 + A @ deltas
+        gains[chosen] = -np.inf
+        argmax_mv = np.argmax(gains, axis=0)  # first maximum, i.e. the smallest userID
+        chosen[argmax_mv, columns] = True
+        for a, v in enumerate(argmax_mv.tolist()):
+            S[a].append(v)
+            bt[G.neighbor_indices(v), a] += 1
+    return [set(G.ids[seeds].tolist()) for seeds in S]
+
+
+def frontier_infection_step(G, tracker):
+    """
+    one timestep of the simulation: every node that is not infected yet gets infected with its buying probability.
+    only the frontier of the tracker is drawn for. a node with buying probability 0 is never infected by its draw, so
+    skipping it keeps the same per-node Bernoulli semantics, and a timestep costs O(frontier) instead of O(|V|).
+    :param G: network graph (CSRGraph)
+    :param tracker: BuyingProbabilityTracker of G
+    :return: number of newly infected nodes
+    """
+    frontier = sorted(tracker.frontier)
+    instrumentation.count("random draws", len(frontier))
+    newly_infected = [i for i in frontier if G.buying_probability[i] > random.random()]
+    tracker.infect(newly_infected)
+    return len(newly_infected)
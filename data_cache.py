@@ -0,0 +1,198 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from csr_graph import CSRGraph, build_csr_graph
+from play_counts import PlayCounts
+
+CACHE_DIR = './.data_cache'
+
+
+def _fingerprint(path, check):
+    """
+    :param path: source file
+    :param check: 'mtime' to compare size and modification time, 'hash' to compare the content hash as well
+    :return: dict identifying the current version of the source file
+    """
+    stat = os.stat(path)
+    fingerprint = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+    if check == 'hash':
+        sha1 = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                sha1.update(block)
+        fingerprint = {'size': stat.st_size, 'sha1': sha1.hexdigest()}
+    return fingerprint
+
+
+def cached_arrays(path, kind, parse, cache_dir=CACHE_DIR, check='mtime', write=None):
+    """
+    Load the arrays parsed from a source file from a binary snapshot (one memory-mapped .npy file per array). The
+    snapshot is rebuilt with parse when it is missing or the source file changed.
+    :param path: source file (csv)
+    :param kind: name of the parsed representation (several representations of one source are cached separately)
+    :param parse: function path -> dict of array name -> np.array
+    :param cache_dir: directory of the snapshots
+    :param check: 'mtime' (size and modification time) or 'hash' (size and content hash) invalidation
+    :param write: optional replacement of parse for outputs larger than memory: function (path, directory) -> list of
+                  array names, that writes the <name>.npy files to the directory itself
+    :return: dict of array name -> read-only memory-mapped np.array
+    """
+    snapshot = os.path.join(cache_dir, f"{os.path.basename(path)}.{kind}")
+    meta_path = os.path.join(snapshot, 'meta.json')
+    fingerprint = _fingerprint(path, check)
+    meta = None
+    if os.path.exists(meta_path):
+        with open(meta_path) as f:
+            meta = json.load(f)
+    if meta is None or meta['source'] != fingerprint:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp = tempfile.mkdtemp(dir=cache_dir)
+        if write is not None:
+            names = write(path, tmp)
+        else:
+            arrays = parse(path)
+            for name, array in arrays.items():
+                np.save(os.path.join(tmp, f"{name}.npy"), np.ascontiguousarray(array))
+            names = list(arrays)
+        meta = {'source': fingerprint, 'arrays': names}
+        with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+            json.dump(meta, f)
+        shutil.rmtree(snapshot, ignore_errors=True)
+        os.replace(tmp, snapshot)
+    return {name: np.load(os.path.join(snapshot, f"{name}.npy"), mmap_mode='r') for name in meta['arrays']}
+
+
+def _parse_edge_list(path):
+    instaglam = pd.read_csv(path)
+    return {'userID': instaglam['userID'].values, 'friendID': instaglam['friendID'].values}
+
+
+def _parse_csr_graph(path):
+    G = build_csr_graph(pd.read_csv(path))
+    return {'ids': G.ids, 'indptr': G.indptr, 'indices': G.indices}
+
+
+def _edge_chunks(path, chunksize):
+    for chunk in pd.read_csv(path, usecols=['userID', 'friendID'], chunksize=chunksize):
+        yield chunk['userID'].values.astype(np.int64), chunk['friendID'].values.astype(np.int64)
+
+
+def _write_streamed_csr(path, directory, chunksize):
+    """
+    Build the CSR arrays of a friendships csv that does not fit in memory. The file is read in chunks three times:
+    to intern the userIDs (kept as one sorted array), to count degrees, and to scatter both directions of every edge
+    into a disk-backed neighbor buffer. The rows are then sorted and deduplicated block by block, compacting the
+    buffer in place. Duplicated edges are dropped and a self loop is kept as a doubled neighbor entry, like in
+    CSRGraph, so both builds of the 'csr' snapshot give the same graph. Peak memory is O(|V| + chunksize); the
+    neighbor arrays only live on disk.
+    :param path: friendships csv (instaglam)
+    :param directory: output directory of ids.npy, indptr.npy and indices.npy
+    :param chunksize: number of csv rows per chunk
+    :return: list of the written array names
+    """
+    ids = np.zeros(0, dtype=np.int64)
+    for users, friends in _edge_chunks(path, chunksize):
+        ids = np.union1d(ids, np.union1d(users, friends))
+    n = len(ids)
+
+    degrees = np.zeros(n, dtype=np.int64)  # with duplicated edges, fixed after deduplication
+    for users, friends in _edge_chunks(path, chunksize):
+        u, v = np.searchsorted(ids, users), np.searchsorted(ids, friends)
+        degrees += np.bincount(u, minlength=n) + np.bincount(v, minlength=n)
+    starts = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(degrees, out=starts[1:])
+
+    raw_path = os.path.join(directory, 'neighbors.raw')
+    raw = np.memmap(raw_path, dtype=np.int32, mode='w+', shape=(max(int(starts[-1]), 1),))
+    filled = starts[:-1].copy()
+    for users, friends in _edge_chunks(path, chunksize):
+        u, v = np.searchsorted(ids, users), np.searchsorted(ids, friends)
+        src = np.concatenate([u, v])
+        dst = np.concatenate([v, u])
+        order = np.argsort(src, kind='stable')
+        src, dst = src[order], dst[order]
+        rank = np.arange(len(src)) - np.searchsorted(src, src)  # position among the chunk's edges of the same node
+        raw[filled[src] + rank] = dst
+        filled += np.bincount(src, minlength=n)
+
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    written = 0
+    node = 0
+    while node < n:
+        end = min(n, max(node + 1, int(np.searchsorted(starts, starts[node] + 2 * chunksize, side='right')) - 1))
+        block = np.array(raw[starts[node]:starts[end]])
+        row = np.repeat(np.arange(node, end), degrees[node:end])
+        order = np.lexsort((block, row))
+        block, row = block[order], row[order]
+        keep = np.ones(len(block), dtype=bool)
+        keep[1:] = (block[1:] != block[:-1]) | (row[1:] != row[:-1])
+        block, row = block[keep], row[keep]
+        loops = 1 + (block == row)  # a self loop is kept twice, the raw buffer holds at least two copies of it
+        block, row = np.repeat(block, loops), np.repeat(row, loops)
+        raw[written:written + len(block)] = block  # written <= starts[node], so nothing unread is overwritten
+        indptr[node + 1:end + 1] = written + np.cumsum(np.bincount(row - node, minlength=end - node))
+        written += len(block)
+        node = end
+
+    indices = np.lib.format.open_memmap(os.path.join(directory, 'indices.npy'), mode='w+', dtype=np.int32,
+                                        shape=(written,))
+    for start in range(0, written, 2 * chunksize):
+        end = min(written, start + 2 * chunksize)
+        indices[start:end] = raw[start:end]
+    indices.flush()
+    del indices, raw
+    os.remove(raw_path)
+    np.save(os.path.join(directory, 'ids.npy'), ids)
+    np.save(os.path.join(directory, 'indptr.npy'), indptr)
+    return ['ids', 'indptr', 'indices']
+
+
+def _parse_play_counts(path):
+    table = PlayCounts(pd.read_csv(path))
+    return {'userID': table.users, 'artistID': table.artists, '#plays': table.plays}
+
+
+def load_edge_list(path, cache_dir=CACHE_DIR, check='mtime'):
+    """
+    :param path: friendships csv (instaglam)
+    :return: description of friendships between members in the network (pd.Dataframe over the cached arrays)
+    """
+    return pd.DataFrame(cached_arrays(path, 'edges', _parse_edge_list, cache_dir, check), copy=False)
+
+
+def load_csr_graph(path, cache_dir=CACHE_DIR, check='mtime', chunksize=None):
+    """
+    :param path: friendships csv (instaglam)
+    :param chunksize: if given, a missing snapshot is built by streaming the csv in chunks of this many rows into
+                      disk-backed arrays, for files that do not fit in memory (see _write_streamed_csr)
+    :return: network graph (CSRGraph) over the cached node-index mapping and CSR arrays
+    """
+    write = None if chunksize is None else lambda source, directory: _write_streamed_csr(source, directory, chunksize)
+    arrays = cached_arrays(path, 'csr', _parse_csr_graph, cache_dir, check, write)
+    return CSRGraph.from_arrays(arrays['ids'], arrays['indptr'], arrays['indices'])
+
+
+def load_play_counts(path='./spotifly.csv', cache_dir=CACHE_DIR, check='mtime'):
+    """
+    :param path: play counts csv (spotifly)
+    :return: PlayCounts over the cached table
+    """
+    arrays = cached_arrays(path, 'plays', _parse_play_counts, cache_dir, check)
+    return PlayCounts.from_arrays(arrays['userID'], arrays['artistID'], arrays['#plays'])
+
+
+def load_data(cache_dir=CACHE_DIR, check='mtime'):
+    """
+    load_data of the scripts, served from the binary snapshots
+    :return: instaglam0, instaglam_1, spotifly DataFrames (spotifly with stripped headers, sorted by artist)
+    """
+    instaglam_1 = load_edge_list('./instaglam_1.csv', cache_dir, check)
+    instaglam0 = load_edge_list('./instaglam0.csv', cache_dir, check)
+    spotifly = pd.DataFrame(cached_arrays('./spotifly.csv', 'plays', _parse_play_counts, cache_dir, check), copy=False)
+    return instaglam0, instaglam_1, spotifly
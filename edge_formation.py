@@ -0,0 +1,442 @@
+import numpy as np
+import scipy.sparse as sp
+
+import instrumentation
+
+
+def _pair_keys(rows, cols, n):
+    """
+    :return: int64 key of every unordered pair (min * n + max)
+    """
+    rows = np.asarray(rows, dtype=np.int64)
+    cols = np.asarray(cols, dtype=np.int64)
+    return np.minimum(rows, cols) * n + np.maximum(rows, cols)
+
+
+def _pairs_from_linear_index(k, n):
+    """
+    map positions in the row-major enumeration of all pairs (i, j), i < j < n to the pairs themselves
+    :param k: positions (np.array)
+    :param n: number of nodes
+    :return: rows, cols
+    """
+    i = np.arange(n, dtype=np.int64)
+    row_starts = i * (n - 1) - i * (i - 1) // 2
+    rows = np.searchsorted(row_starts, k, side='right') - 1
+    cols = k - row_starts[rows] + rows + 1
+    return rows, cols
+
+
+def skip_sample(m, p, rng):
+    """
+    geometric skip-sampling of m independent Bernoulli(p) trials: instead of drawing one number per trial, draw the
+    gaps between consecutive successes. the cost is proportional to the number of successes, not to m.
+    :param m: number of trials
+    :param p: success probability of every trial
+    :param rng: np.random.Generator
+    :return: sorted positions (in range(m)) of the successful trials
+    """
+    if p <= 0 or m <= 0:
+        return np.zeros(0, dtype=np.int64)
+    if p >= 1:
+        return np.arange(m, dtype=np.int64)
+    positions = []
+    last = -1
+    while last < m:
+        batch = int((m - last) * p * 1.1) + 16
+        steps = last + np.cumsum(rng.geometric(p, size=batch))
+        positions.append(steps[steps < m])
+        last = steps[-1]
+    return np.concatenate(positions)
+
+
+def _translate(ids, target_ids):
+    """
+    :param ids: userIDs
+    :param target_ids: sorted userIDs of another index space
+    :return: index in target_ids of every node of ids (-1 for nodes that are not in target_ids)
+    """
+    position = np.searchsorted(target_ids, ids)
+    found = position < len(target_ids)
+    found[found] = target_ids[position[found]] == ids[found]
+    return np.where(found, position, -1)
+
+
+def _sorted_difference(a, b):
+    """
+    :param a: sorted unique keys
+    :param b: sorted unique keys
+    :return: sorted keys of a that are not in b (binary search of a in b, nothing is sorted again)
+    """
+    if not len(b):
+        return a
+    position = np.minimum(np.searchsorted(b, a), len(b) - 1)
+    return a[b[position] != a]
+
+
+def snapshot_diff(G_0, G_1):
+    """
+    compare two snapshots of the network. both edge lists are canonicalized to (min, max) pairs of the union of their
+    userIDs, encoded as sorted int64 keys (see _pair_keys), and compared with set operations on the sorted arrays.
+    :param G_0: network today (CSRGraph)
+    :param G_1: network yesterday (CSRGraph)
+    :return: ids (sorted union of the userIDs, the index space of the keys), keys of the added edges (in G_0 only),
+             keys of the removed edges (in G_1 only)
+    """
+    ids = np.union1d(G_0.ids, G_1.ids)
+    new_keys = np.sort(_pair_keys(*[_translate(G_0.ids, ids)[e] for e in G_0.edge_arrays()], len(ids)))
+    old_keys = np.sort(_pair_keys(*[_translate(G_1.ids, ids)[e] for e in G_1.edge_arrays()], len(ids)))
+    return ids, _sorted_difference(new_keys, old_keys), _sorted_difference(old_keys, new_keys)
+
+
+def common_neighbor_pairs(ids, G_1):
+    """
+    all pairs of nodes that had at least one common friend in G_1 (the 2-hop pairs of yesterday's graph), found from
+    the nonzero entries of the sparse product A_1 * A_1.
+    :param ids: sorted userIDs of the nodes the pairs belong to (G.ids of the graph new edges are drawn for)
+    :param G_1: network graph yesterday (CSRGraph)
+    :return: rows, cols (dense indices in ids, rows < cols), number of common neighbors of every pair
+    """
+    A_1 = G_1.adjacency_matrix()
+    C = sp.triu(A_1 @ A_1, k=1).tocoo()
+    translate = _translate(G_1.ids, ids)
+    rows, cols = translate[C.row], translate[C.col]
+    keep = (rows >= 0) & (cols >= 0)
+    rows, cols = rows[keep], cols[keep]
+    return np.minimum(rows, cols), np.maximum(rows, cols), C.data[keep].astype(np.int64)
+
+
+def common_neighbor_counts(ids, G_1, rows, cols):
+    """
+    number of common friends in G_1 of the given pairs: the entries (A_1 * A_1)[u, v] of the needed pairs only, as row
+    by row products of the sparse adjacency matrix. nodes that are not in G_1 have no common friends.
+    :param ids: sorted userIDs (index space of rows and cols)
+    :param G_1: network graph yesterday (CSRGraph)
+    :param rows: dense indices of the first nodes of the pairs
+    :param cols: dense indices of the second nodes of the pairs
+    :return: np.array of the number of common neighbors of every pair
+    """
+    translate = _translate(np.asarray(ids, dtype=np.int64), G_1.ids)
+    u, v = translate[rows], translate[cols]
+    known = (u >= 0) & (v >= 0)
+    counts = np.zeros(len(u), dtype=np.int64)
+    if known.any():
+        A_1 = G_1.adjacency_matrix()
+        counts[known] = np.asarray(A_1[u[known]].multiply(A_1[v[known]]).sum(axis=1)).ravel()
+    return counts
+
+
+def common_neighbors_histogram(G_0, G_1):
+    """
+    new_edges_by_commoneighbors_histogram for CSRGraphs: the edges formed between G_1 and G_0 come from snapshot_diff
+    and their numbers of common friends in G_1 come from common_neighbor_counts.
+    :param G_0: network today (CSRGraph)
+    :param G_1: network yesterday (CSRGraph)
+    :return: histogram (dict number of common neighbors -> fraction of the new edges)
+    """
+    ids, added, removed = snapshot_diff(G_0, G_1)
+    max_degree = int(G_1.degrees.max())
+    counts = common_neighbor_counts(ids, G_1, added // len(ids), added % len(ids))
+    histogram = np.bincount(counts, minlength=max_degree + 1)
+    total_new_edges = histogram.sum()
+    if total_new_edges == 0:  # prob=0 for every new edge
+        return {i: 0.0 for i in range(max_degree + 1)}
+    return {i: histogram[i] / total_new_edges for i in range(max_degree + 1)}
+
+
+class CommonNeighborsModel:
+    """
+    Incremental common_neighbors_histogram for the simulated days of new edges. The model owns the simulated graph G
+    (new edges are inserted with add_edges instead of G.add_edges_from), so the edges formed on a day are known and the
+    snapshots do not have to be compared. Before the edges of a day are inserted, the number of common friends of
+    every new pair is counted with common_neighbor_counts (the product of the two sparse adjacency rows, O(degree(u) +
+    degree(v)) per edge), and the histogram of the next day is built from these counts. Counts are not kept for all
+    pairs: the histogram only needs the counts of the pairs that became edges, and common_neighbors_index counts its
+    pair on demand. Inserting the edges merges them into the CSR arrays of G (CSRGraph.add_edges_from), which copies
+    the arrays once, so a day costs O(|V| + |E|) besides the counting. The histograms are identical to
+    common_neighbors_histogram(G, G_prev) of the graph before and after every day.
+    """
+
+    def __init__(self, G, G_prev):
+        """
+        :param G: network graph today (CSRGraph). changed by add_edges.
+        :param G_prev: network graph yesterday (CSRGraph)
+        """
+        self.G = G
+        self.G_prev = G_prev
+        self.new_edge_counts = None  # number of common friends yesterday of every edge formed on the last day
+        self._histogram = common_neighbors_histogram(G, G_prev)
+
+    def histogram(self):
+        """
+        :return: histogram of common_neighbors_index (dict number of common neighbors -> fraction of the new edges)
+                 of the edges formed between yesterday and today
+        """
+        return self._histogram
+
+    def common_neighbors_index(self, u, v):
+        """
+        :return: common_neighbors_index(G, G_prev, u, v, histogram()) of the current day
+        """
+        i, j = self.G.index_of([u, v]).tolist()
+        return self._histogram[int(common_neighbor_counts(self.G.ids, self.G_prev, [i], [j])[0])]
+
+    def add_edges(self, rows, cols):
+        """
+        insert the new edges of a day to G and make today yesterday
+        :param rows: first endpoint of every new edge (dense indices)
+        :param cols: second endpoint of every new edge (dense indices). the pairs must not be edges of G yet and must
+                     not repeat, like the output of sample_new_edges.
+        :return: None
+        """
+        G = self.G
+        rows = np.asarray(rows, dtype=np.int64)
+        cols = np.asarray(cols, dtype=np.int64)
+        self.new_edge_counts = common_neighbor_counts(G.ids, G, rows, cols)
+        max_degree = int(G.degrees.max())
+        histogram = np.bincount(self.new_edge_counts, minlength=max_degree + 1)
+        total_new_edges = histogram.sum()
+        if total_new_edges == 0:  # prob=0 for every new edge
+            self._histogram = {i: 0.0 for i in range(max_degree + 1)}
+        else:
+            self._histogram = {i: histogram[i] / total_new_edges for i in range(max_degree + 1)}
+        self.G_prev = G.copy()  # shares the edge arrays, add_edges_from gives G new ones
+        G.add_edges_from(rows, cols)
+
+
+class PairProbabilities:
+    """
+    New edge probability of every unordered pair of nodes, without the pair matrix in memory: explicit probabilities
+    are kept only for the pairs in keys (sorted pair keys, see _pair_keys) and every other pair has the background
+    probability. A uniform model therefore takes constant storage and a neighbor-based model takes storage
+    proportional to its support.
+    P[(i, j)] answers like the dict of build_probabilities_dict, so add_new_edges can query the model lazily, and
+    block(rows, cols) answers a whole block of pairs at once.
+    """
+
+    def __init__(self, ids, background=0, keys=None, values=None):
+        """
+        :param ids: sorted userIDs of the nodes (index space of keys)
+        :param background: probability of every pair that is not in keys
+        :param keys: sorted int64 pair keys of the pairs with explicit probabilities
+        :param values: probabilities of the pairs in keys
+        """
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.background = background
+        self.keys = np.zeros(0, dtype=np.int64) if keys is None else np.asarray(keys, dtype=np.int64)
+        self.values = np.zeros(0, dtype=np.float64) if values is None else np.asarray(values, dtype=np.float64)
+        self._lookup = None
+
+    def __getitem__(self, pair):
+        if not len(self.keys):
+            return self.background
+        if self._lookup is None:  # built on the first scalar query only
+            n = len(self.ids)
+            u, v = self.ids[self.keys // n].tolist(), self.ids[self.keys % n].tolist()
+            self._lookup = dict(zip(zip(u, v), self.values.tolist()))
+        i, j = pair
+        return self._lookup.get((i, j) if i < j else (j, i), self.background)
+
+    def block(self, rows, cols):
+        """
+        :param rows: dense indices of the first nodes of the pairs
+        :param cols: dense indices of the second nodes of the pairs
+        :return: np.array of the probabilities of the pairs
+        """
+        keys = _pair_keys(rows, cols, len(self.ids))
+        P = np.full(len(keys), self.background, dtype=np.float64)
+        if len(self.keys):
+            position = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+            found = self.keys[position] == keys
+            P[found] = self.values[position[found]]
+        return P
+
+
+def uniform_probabilities(ids, p):
+    """
+    :param ids: sorted userIDs of the nodes
+    :param p: probability of every pair (prob_p_forall_index(p))
+    :return: PairProbabilities with constant storage
+    """
+    return PairProbabilities(ids, background=p)
+
+
+def common_neighbors_index_probabilities(ids, G_1, hist):
+    """
+    common_neighbors_index for all pairs at once: the number of common friends of every 2-hop pair is its entry of
+    A_1 * A_1, and the pairs without common friends get hist[0].
+    :param ids: sorted userIDs of the nodes
+    :param G_1: network graph yesterday (CSRGraph)
+    :param hist: histogram of common_neighbors_index
+    :return: PairProbabilities with sparse storage
+    """
+    ids = np.asarray(ids, dtype=np.int64)
+    rows, cols, counts = common_neighbor_pairs(ids, G_1)
+    keys = _pair_keys(rows, cols, len(ids))
+    order = np.argsort(keys)
+    values = np.array([hist[i] for i in range(max(hist) + 1)], dtype=np.float64)[counts[order]]
+    return PairProbabilities(ids, hist[0], keys[order], values)
+
+
+def friendly_index_probabilities(ids, G_0, G_1):
+    """
+    friendly_index for all pairs at once. the friendliness (G_0.degree - G_1.degree) / G_0.degree of every node is
+    computed once from the degree arrays, the number of common friends of every 2-hop pair of G_1 is its entry of
+    A_1 * A_1 and the size of the union of the friends is the sum of the degrees minus the intersection. pairs without
+    common friends have no chance to meet (probability 0). the values are identical to friendly_index.
+    :param ids: sorted userIDs of the nodes
+    :param G_0: network graph at time t=0 (CSRGraph)
+    :param G_1: network graph at time t=-1 (CSRGraph)
+    :return: PairProbabilities with sparse storage
+    """
+    ids = np.asarray(ids, dtype=np.int64)
+    degree_0 = G_0.degrees[G_0.index_of(ids)]
+    degree_1 = G_1.degrees[G_1.index_of(ids)]
+    friendly = (degree_0 - degree_1) / degree_0
+    rows, cols, intersection = common_neighbor_pairs(ids, G_1)
+    keys = _pair_keys(rows, cols, len(ids))
+    order = np.argsort(keys)
+    rows, cols, intersection = rows[order], cols[order], intersection[order]
+    union = degree_1[rows] + degree_1[cols] - intersection
+    instrumentation.count("pair probability evaluations", len(keys))
+    values = (friendly[rows] + friendly[cols]) * (intersection / union)
+    return PairProbabilities(ids, 0, keys[order], values)
+
+
+_MERSENNE_PRIME = (1 << 31) - 1
+
+
+def minhash_signatures(G_1, num_hashes=128, rng=None, chunk=16):
+    """
+    MinHash signatures of the neighbor sets of G_1: signature k of node i is the minimum of the k-th random hash
+    (a * x + b) mod p over the friends x of i, so two nodes have the same k-th signature with probability equal to the
+    Jaccard similarity of their friends.
+    :param G_1: network graph yesterday (CSRGraph)
+    :param num_hashes: signature length
+    :param rng: np.random.Generator
+    :param chunk: number of hash functions evaluated at once (memory is O(|E| * chunk))
+    :return: |V_1| x num_hashes uint64 np.array (p for nodes without friends)
+    """
+    rng = np.random.default_rng() if rng is None else rng
+    a = rng.integers(1, _MERSENNE_PRIME, size=num_hashes, dtype=np.uint64)
+    b = rng.integers(0, _MERSENNE_PRIME, size=num_hashes, dtype=np.uint64)
+    signatures = np.full((len(G_1.ids), num_hashes), _MERSENNE_PRIME, dtype=np.uint64)
+    has_friends = G_1.degrees > 0
+    friends = np.asarray(G_1.indices, dtype=np.uint64)[:, None]
+    for start in range(0, num_hashes, chunk):
+        hashes = (friends * a[None, start:start + chunk] + b[None, start:start + chunk]) % _MERSENNE_PRIME
+        if len(hashes):
+            minimum = np.minimum.reduceat(hashes, G_1.indptr[:-1][has_friends], axis=0)
+            signatures[has_friends, start:start + chunk] = minimum
+    return signatures
+
+
+def lsh_candidate_pairs(signatures, bands, rng=None):
+    """
+    locality-sensitive hashing of MinHash signatures: the signature is split to bands and two nodes are a candidate
+    pair if all the rows of some band are equal, which happens with probability 1 - (1 - J^r)^bands for Jaccard
+    similarity J and r rows per band.
+    :param signatures: |V| x num_hashes signatures (minhash_signatures)
+    :param bands: number of bands (must divide num_hashes)
+    :param rng: np.random.Generator
+    :return: sorted keys (see _pair_keys) of the candidate pairs
+    """
+    rng = np.random.default_rng() if rng is None else rng
+    n, num_hashes = signatures.shape
+    if num_hashes % bands:
+        raise ValueError(f"{bands} bands do not divide a signature of length {num_hashes}")
+    rows = num_hashes // bands
+    has_friends = np.flatnonzero((signatures != _MERSENNE_PRIME).any(axis=1))
+    multipliers = rng.integers(1, np.iinfo(np.int64).max, size=rows, dtype=np.uint64) | np.uint64(1)
+    keys = []
+    for band in range(bands):
+        # bucket of every node: a random linear combination of the band rows (mod 2^64)
+        bucket = (signatures[has_friends, band * rows:(band + 1) * rows] * multipliers).sum(axis=1)
+        order = np.argsort(bucket, kind='stable')
+        bucket, nodes = bucket[order], has_friends[order]
+        later = np.searchsorted(bucket, bucket, side='right') - np.arange(len(bucket)) - 1  # same bucket, later
+        first = np.repeat(np.arange(len(bucket)), later)
+        second = first + 1 + np.arange(later.sum()) - np.repeat(np.cumsum(later) - later, later)
+        keys.append(_pair_keys(nodes[first], nodes[second], n))
+    keys = np.sort(np.concatenate(keys))
+    return keys[np.concatenate([[True], keys[1:] != keys[:-1]])] if len(keys) else keys
+
+
+def friendly_index_minhash_probabilities(ids, G_0, G_1, num_hashes=128, bands=64, threshold=0.1, rng=None):
+    """
+    Approximate friendly_index_probabilities for graphs whose 2-hop pairs are too many to enumerate: the chance to meet
+    (Jaccard similarity of the friends in G_1) is estimated from MinHash signatures, and only the LSH candidate pairs
+    with an estimated similarity of at least threshold get a probability (all other pairs get 0). A longer signature
+    gives a more accurate estimate; more bands (fewer rows per band) find pairs of lower similarity, at the cost of
+    more candidates. Pairs are found reliably above a similarity of about (1 / bands) ** (bands / num_hashes), so the
+    defaults (2 rows per band) suit thresholds around 0.1.
+    :param ids: sorted userIDs of the nodes
+    :param G_0: network graph at time t=0 (CSRGraph)
+    :param G_1: network graph at time t=-1 (CSRGraph)
+    :param num_hashes: signature length
+    :param bands: number of LSH bands (must divide num_hashes)
+    :param threshold: minimal estimated chance to meet of a pair with a nonzero probability
+    :param rng: np.random.Generator
+    :return: PairProbabilities with sparse storage
+    """
+    rng = np.random.default_rng() if rng is None else rng
+    ids = np.asarray(ids, dtype=np.int64)
+    degree_0 = G_0.degrees[G_0.index_of(ids)]
+    degree_1 = G_1.degrees[G_1.index_of(ids)]
+    friendly = (degree_0 - degree_1) / degree_0
+    signatures = minhash_signatures(G_1, num_hashes, rng)
+    keys = lsh_candidate_pairs(signatures, bands, rng)
+    rows, cols = keys // len(G_1.ids), keys % len(G_1.ids)
+    chance_to_meet = (signatures[rows] == signatures[cols]).mean(axis=1)
+    keep = chance_to_meet >= threshold
+    translate = _translate(G_1.ids, ids)
+    rows, cols = translate[rows[keep]], translate[cols[keep]]
+    known = (rows >= 0) & (cols >= 0)
+    rows, cols, chance_to_meet = rows[known], cols[known], chance_to_meet[keep][known]
+    keys = _pair_keys(rows, cols, len(ids))
+    order = np.argsort(keys)
+    instrumentation.count("pair probability evaluations", len(keys))
+    values = (friendly[rows] + friendly[cols]) * chance_to_meet
+    return PairProbabilities(ids, 0, keys[order], values[order])
+
+
+def sample_new_edges(G, P, rng=None):
+    """
+    sparse replacement of the all-pairs loop of add_new_edges. every pair (i, j) that is not an edge of G becomes an
+    edge independently with probability P[(i, j)], like in add_new_edges, but only pairs that can have a nonzero
+    probability are visited: the pairs with explicit probabilities in P are drawn in one vectorized block, and the
+    pairs with the background probability are sampled by geometric skip-sampling.
+    :param G: network graph new edges are drawn for (CSRGraph)
+    :param P: new edges probabilities over the nodes of G (PairProbabilities)
+    :param rng: np.random.Generator
+    :return: rows, cols - dense indices in G of the new edges (not inserted to G)
+    """
+    if not np.array_equal(P.ids, G.ids):
+        raise ValueError("probabilities model and graph have different nodes")
+    rng = np.random.default_rng() if rng is None else rng
+    n = len(G.ids)
+    edge_keys = np.sort(_pair_keys(*G.edge_arrays(), n))
+
+    new_rows, new_cols = [], []
+    if len(P.keys):
+        candidates = P.keys[~np.isin(P.keys, edge_keys, assume_unique=True)]
+        rows, cols = candidates // n, candidates % n
+        instrumentation.count("random draws", len(candidates))
+        chosen = rng.random(len(candidates)) < P.block(rows, cols)
+        new_rows.append(rows[chosen])
+        new_cols.append(cols[chosen])
+
+    positions = skip_sample(n * (n - 1) // 2, P.background, rng)
+    instrumentation.count("random draws", len(positions))  # one geometric draw per skip
+    if len(positions):
+        rows, cols = _pairs_from_linear_index(positions, n)
+        keys = rows * n + cols
+        chosen = ~np.isin(keys, edge_keys) & ~np.isin(keys, P.keys)
+        new_rows.append(rows[chosen])
+        new_cols.append(cols[chosen])
+
+    if not new_rows:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    new_rows, new_cols = np.concatenate(new_rows), np.concatenate(new_cols)
+    instrumentation.count("edges added", len(new_rows))
+    return new_rows, new_cols
@@ -0,0 +1,136 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import csr_graph
+import data_cache
+import edge_formation
+
+DEFAULT_CONFIG = {
+    'artist': 532992,
+    'influencers': [[117383, 308470, 994520, 197117, 457566],
+                    [32806, 117383, 40242, 197117, 457566],
+                    [117383, 994520, 961018, 197117, 457566],
+                    [117383, 74425, 961018, 197117, 457566]],
+    # 'common_neighbors', 'friendly' or a number p for prob_p_forall_index(p)
+    'methods': ['common_neighbors', 'friendly', 1 / 800, 0],
+    'replicas': 1,  # simulations per (influencers, method) cell
+    'days': 7,  # days of new edges simulated on G_random for the common_neighbors histogram
+    'steps': 6,  # timesteps of the infection simulation
+    'seed': 0,
+    'processes': 1,
+    'output': './grid_results.csv',
+}
+
+_shared = None  # shared artifacts of a grid pool worker
+
+
+def _method_name(method):
+    return method if isinstance(method, str) else f"prob_p_forall_index({method})"
+
+
+def build_shared(config):
+    """
+    compute the artifacts that do not depend on the influencers once for the whole grid: the loaded data, G_0 with
+    the h vector of the artist, G_1, and the new edges probabilities of every method that does not depend on the
+    simulated graph (all but friendly). for the common_neighbors method they use the histogram of the evolved G_random.
+    :param config: grid configuration (see DEFAULT_CONFIG)
+    :return: dict of the shared artifacts
+    """
+    rng = np.random.default_rng(config['seed'])
+    G_0 = data_cache.load_csr_graph('./instaglam0.csv')
+    G_1 = data_cache.load_csr_graph('./instaglam_1.csv')
+    G_0.h[:] = data_cache.load_play_counts().h(G_0.nodes, config['artist'])
+    models = {}
+    if 'common_neighbors' in config['methods']:
+        G_random = G_0.copy()
+        model = edge_formation.CommonNeighborsModel(G_random, G_1)
+        histogram = None
+        for i in range(config['days']):
+            histogram = model.histogram()
+            P = edge_formation.common_neighbors_index_probabilities(G_random.ids, G_1, histogram)
+            model.add_edges(*edge_formation.sample_new_edges(G_random, P, rng))
+        models['common_neighbors'] = edge_formation.common_neighbors_index_probabilities(G_0.ids, G_1, histogram)
+    for method in config['methods']:
+        if not isinstance(method, str):
+            models[method] = edge_formation.uniform_probabilities(G_0.ids, method)
+    return {'G_0': G_0, 'G_1': G_1, 'models': models, 'steps': config['steps']}
+
+
+def _probability_model(shared, G, method):
+    """
+    :return: new edges probabilities of the method for the simulated graph G at the current timestep (only friendly
+             depends on G, the other models are shared by all the cells and timesteps)
+    """
+    if method == 'friendly':
+        return edge_formation.friendly_index_probabilities(G.ids, G, shared['G_1'])
+    return shared['models'][method]
+
+
+def run_cell(shared, influencers, method, rng):
+    """
+    the simulation of simulations_not_to_submit.py for one grid cell
+    :param shared: shared artifacts (build_shared)
+    :param influencers: list of influencers
+    :param method: new edges method (see DEFAULT_CONFIG)
+    :param rng: np.random.Generator
+    :return: list of the number of infected nodes after every timestep
+    """
+    G = shared['G_0'].copy()
+    G.infected[G.index_of(influencers)] = True
+    tracker = csr_graph.BuyingProbabilityTracker(G)
+    infected = []
+    for t in range(1, shared['steps'] + 1):
+        tracker.infect(np.flatnonzero(G.buying_probability > rng.random(len(G.ids))))
+        infected.append(int(G.infected.sum()))
+        if t < shared['steps']:
+            tracker.add_edges(*edge_formation.sample_new_edges(G, _probability_model(shared, G, method), rng))
+    return infected
+
+
+def _init_worker(shared):
+    global _shared
+    _shared = shared
+
+
+def _run_cell_in_worker(influencers, method, seed):
+    return run_cell(_shared, influencers, method, np.random.default_rng(seed))
+
+
+def run_grid(config=None):
+    """
+    run every (influencers, method, replica) cell of the grid, reusing the shared artifacts, on a process pool
+    :param config: grid configuration (DEFAULT_CONFIG values are used for missing keys)
+    :return: tidy pd.DataFrame (one row per cell and timestep), also written to config['output'] as csv
+    """
+    config = dict(DEFAULT_CONFIG, **(config or {}))
+    shared = build_shared(config)
+    cells = [(influencers, method, replica) for influencers in config['influencers']
+             for method in config['methods'] for replica in range(config['replicas'])]
+    seeds = np.random.SeedSequence(config['seed']).spawn(len(cells))
+    args = ([c[0] for c in cells], [c[1] for c in cells], seeds)
+    if config['processes'] <= 1:
+        _init_worker(shared)
+        results = list(map(_run_cell_in_worker, *args))
+    else:
+        context = multiprocessing.get_context("fork" if "fork" in multiprocessing.get_all_start_methods()
+                                              else "spawn")
+        with ProcessPoolExecutor(config['processes'], mp_context=context, initializer=_init_worker,
+                                 initargs=(shared,)) as pool:
+            results = list(pool.map(_run_cell_in_worker, *args))
+
+    rows = []
+    for (influencers, method, replica), infected in zip(cells, results):
+        for t, infected_cnt in enumerate(infected, start=1):
+            rows.append({'artist': config['artist'], 'influencers': ' '.join(map(str, influencers)),
+                         'method': _method_name(method), 'replica': replica, 'time': t, 'infected': infected_cnt})
+    table = pd.DataFrame(rows)
+    if config['output']:
+        table.to_csv(config['output'], index=False)
+    return table
+
+
+if __name__ == '__main__':
+    print(run_grid().pivot_table(index=['influencers', 'method'], columns='time', values='infected'))
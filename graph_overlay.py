@@ -0,0 +1,186 @@
+from itertools import chain
+
+_NO_NEIGHBORS = frozenset()
+
+
+class GraphOverlay:
+    """
+    Copy-on-write layer over a network graph, an alternative to copying the whole nx.Graph for every simulated day or
+    scenario.
+    The root nx.Graph is never changed. The edges added over it are kept in one merged delta (node -> set of the
+    neighbors added in this layer and in the layers below), so has_edge, neighbors and degree cost one lookup in the
+    root and one in the delta, however many layers there are. A new layer starts with a shallow copy of the delta of
+    its base and copies the neighbor set of a node only when an edge of the node is added in it. Node attributes are
+    copied the same way: G.nodes[n] reads the attributes of the base, and the dict of n is copied to the layer the
+    first time one of its attributes is written. Keeping "yesterday" is cheap: start a new layer on top of the current
+    one and keep the old one.
+    The layer exposes the part of the nx.Graph interface used by the scripts (nodes, edges, degree, neighbors,
+    has_edge, add_edge, number_of_nodes, number_of_edges). The nodes are the nodes of the root.
+    """
+
+    def __init__(self, base):
+        """
+        :param base: network graph (nx.Graph or GraphOverlay). it must not be changed while the layer is used.
+        """
+        self.base = base
+        if isinstance(base, GraphOverlay):
+            self._root = base._root  # the nx.Graph under all the layers
+            self._added = dict(base._added)  # node -> set of the added neighbors (shared with the base until changed)
+            self._attributes = dict(base._attributes)  # node -> attributes (shared with the base until changed)
+            self._edge_lists = base._edge_lists + [[]]  # the edges added in every layer, this layer's is the last
+            self._number_of_added_edges = base._number_of_added_edges
+        else:
+            self._root = base
+            self._added = {}
+            self._attributes = {}
+            self._edge_lists = [[]]
+            self._number_of_added_edges = 0
+        self._own_neighbors = set()  # nodes whose set in _added belongs to this layer
+        self._own_attributes = set()  # nodes whose dict in _attributes belongs to this layer
+        self.nodes = _NodeView(self)
+        self.edges = _EdgeView(self)
+        self.degree = _DegreeView(self)
+
+    def layer(self):
+        """
+        :return: a new GraphOverlay on top of this one. this layer must not be changed afterwards.
+        """
+        return GraphOverlay(self)
+
+    def __contains__(self, n):
+        return n in self._root
+
+    def __iter__(self):
+        return iter(self._root)
+
+    def __len__(self):
+        return len(self._root)
+
+    def _read_attributes(self, n):
+        """
+        :return: attributes dict of node n, possibly shared with the base (must not be changed)
+        """
+        attributes = self._attributes.get(n)
+        return attributes if attributes is not None else self._root.nodes[n]
+
+    def _write_attributes(self, n):
+        """
+        :return: attributes dict of node n that belongs to this layer (copied from the base on the first write)
+        """
+        if n not in self._own_attributes:
+            self._attributes[n] = dict(self._read_attributes(n))
+            self._own_attributes.add(n)
+        return self._attributes[n]
+
+    def neighbors(self, n):
+        added = self._added.get(n)
+        return chain(self._root.neighbors(n), added) if added else self._root.neighbors(n)
+
+    def has_edge(self, u, v):
+        return v in self._added.get(u, _NO_NEIGHBORS) or self._root.has_edge(u, v)
+
+    def add_edge(self, u, v):
+        """
+        add the edge (u, v) to this layer (nothing is done if it already exists)
+        :param u: a node of the base
+        :param v: a node of the base
+        :return: None
+        """
+        if u not in self._root or v not in self._root:
+            raise KeyError(u if u not in self._root else v)
+        if self.has_edge(u, v):
+            return
+        for a, b in ((u, v), (v, u)):
+            if a not in self._own_neighbors:
+                self._added[a] = set(self._added.get(a, _NO_NEIGHBORS))
+                self._own_neighbors.add(a)
+            self._added[a].add(b)
+        self._edge_lists[-1].append((u, v))
+        self._number_of_added_edges += 1
+
+    def add_edges_from(self, edges):
+        for u, v in edges:
+            self.add_edge(u, v)
+
+    def number_of_nodes(self):
+        return self._root.number_of_nodes()
+
+    def number_of_edges(self):
+        return self._root.number_of_edges() + self._number_of_added_edges
+
+
+class _NodeAttributes:
+    """
+    G.nodes[n] of a GraphOverlay: reads the attributes of n in the layer, and writes copy them to the layer first
+    """
+
+    def __init__(self, G, n):
+        self._G = G
+        self._n = n
+
+    def __getitem__(self, key):
+        return self._G._read_attributes(self._n)[key]
+
+    def __setitem__(self, key, value):
+        self._G._write_attributes(self._n)[key] = value
+
+    def __contains__(self, key):
+        return key in self._G._read_attributes(self._n)
+
+    def __iter__(self):
+        return iter(self._G._read_attributes(self._n))
+
+    def __len__(self):
+        return len(self._G._read_attributes(self._n))
+
+    def get(self, key, default=None):
+        return self._G._read_attributes(self._n).get(key, default)
+
+    def items(self):
+        return self._G._read_attributes(self._n).items()
+
+
+class _NodeView:
+    def __init__(self, G):
+        self._G = G
+
+    def __iter__(self):
+        return iter(self._G._root.nodes)
+
+    def __len__(self):
+        return len(self._G._root)
+
+    def __contains__(self, n):
+        return n in self._G._root
+
+    def __getitem__(self, n):
+        if n not in self._G._root:
+            raise KeyError(n)
+        return _NodeAttributes(self._G, n)
+
+
+class _EdgeView:
+    def __init__(self, G):
+        self._G = G
+
+    def __iter__(self):
+        return chain(self._G._root.edges, *self._G._edge_lists)
+
+    def __len__(self):
+        return self._G.number_of_edges()
+
+    def __contains__(self, e):
+        u, v = e
+        return u in self._G and v in self._G and self._G.has_edge(u, v)
+
+
+class _DegreeView:
+    def __init__(self, G):
+        self._G = G
+
+    def __call__(self, n):
+        return self._G._root.degree(n) + len(self._G._added.get(n, _NO_NEIGHBORS))
+
+    def __iter__(self):
+        for n in self._G._root.nodes:
+            yield n, self(n)
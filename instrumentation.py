@@ -0,0 +1,127 @@
+import atexit
+import cProfile
+import json
+import os
+import pstats
+import sys
+import time
+
+try:
+    import resource
+except ImportError:  # not available on windows
+    resource = None
+
+_enabled = False
+_profile = False
+_profile_dir = None
+_stages = []  # finished stages
+_current = None  # running stage
+_totals = {}  # counters summed over the whole run
+_series = {}  # values recorded with append, e.g. edges added per day
+
+
+def enable(output=None, profile=False, profile_dir=None):
+    """
+    switch the instrumentation on. while it is off, count and append return immediately.
+    :param output: path of the JSON report written when the program exits (None - write_report must be called)
+    :param profile: boolean. True to run every stage under cProfile and add its top functions to the report
+    :param profile_dir: if given (with profile), the pstats dump of every stage is written there as <stage>.prof
+    :return: None
+    """
+    global _enabled, _profile, _profile_dir
+    _enabled = True
+    _profile = profile
+    _profile_dir = profile_dir
+    if output is not None:
+        atexit.register(write_report, output)
+
+
+def enabled():
+    return _enabled
+
+
+def count(name, n=1):
+    """
+    add n to the counter name (of the whole run and of the running stage)
+    """
+    if not _enabled:
+        return
+    _totals[name] = _totals.get(name, 0) + int(n)
+    if _current is not None:
+        _current['counters'][name] = _current['counters'].get(name, 0) + int(n)
+
+
+def append(name, value):
+    """
+    record one more value of the series name (for values that change along the run, e.g. per simulated day)
+    """
+    if _enabled:
+        _series.setdefault(name, []).append(value)
+
+
+def _peak_memory_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 ** 2 if sys.platform == 'darwin' else peak / 1024  # bytes on mac, KB on linux
+
+
+def start_stage(name):
+    """
+    finish the running stage (if any) and start a new one
+    :param name: stage name
+    :return: None
+    """
+    global _current
+    if not _enabled:
+        return
+    end_stage()
+    _current = {'name': name, 'counters': {}, 'start': time.perf_counter(), 'profiler': None}
+    if _profile:
+        _current['profiler'] = cProfile.Profile()
+        _current['profiler'].enable()
+
+
+def end_stage():
+    """
+    finish the running stage and record its wall time, counters, the peak memory of the process so far and its
+    profile
+    :return: None
+    """
+    global _current
+    if not _enabled or _current is None:
+        return
+    stage, _current = _current, None
+    seconds = time.perf_counter() - stage['start']
+    record = {'stage': stage['name'], 'seconds': seconds, 'peak_memory_mb': _peak_memory_mb(),
+              'counters': stage['counters']}
+    profiler = stage['profiler']
+    if profiler is not None:
+        profiler.disable()
+        stats = pstats.Stats(profiler)
+        if _profile_dir is not None:
+            os.makedirs(_profile_dir, exist_ok=True)
+            stats.dump_stats(os.path.join(_profile_dir, f"{stage['name'].replace(' ', '_')}.prof"))
+        top = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:20]
+        record['profile'] = [{'function': f"{file}:{line}({function})", 'calls': calls, 'tottime': tottime,
+                              'cumtime': cumtime}
+                             for (file, line, function), (_, calls, tottime, cumtime, _) in top]
+    _stages.append(record)
+
+
+def report():
+    """
+    :return: dict of the finished stages, the counters of the whole run and the recorded series
+    """
+    return {'stages': _stages, 'counters': _totals, 'series': _series, 'peak_memory_mb': _peak_memory_mb()}
+
+
+def write_report(path):
+    """
+    finish the running stage and write the report as JSON
+    :param path: output file
+    :return: None
+    """
+    end_stage()
+    with open(path, 'w') as f:
+        json.dump(report(), f, indent=2)
@@ -0,0 +1,80 @@
+import numpy as np
+
+
+class PlayCounts:
+    """
+    Indexed (userID, artistID) -> #plays table, built once from the spotifly DataFrame.
+    Rows are kept sorted by (artistID, userID) with an offset per artist (a sparse artist x user matrix in CSC form),
+    so the h values of all nodes for an artist are one vectorized join, and a hash index answers single lookups in O(1).
+    """
+
+    def __init__(self, spotifly):
+        """
+        :param spotifly: play counts of users per artist (pd.Dataframe). the leading space of the ' artistID' header
+                         is stripped.
+        """
+        spotifly = spotifly.rename(columns=str.strip)
+        users = spotifly['userID'].values.astype(np.int64)
+        artists = spotifly['artistID'].values.astype(np.int64)
+        plays = spotifly['#plays'].values.astype(np.int64)
+        order = np.lexsort((users, artists))  # stable, so the first row of a duplicated pair stays first
+        users, artists, plays = users[order], artists[order], plays[order]
+        first = np.ones(len(users), dtype=bool)
+        first[1:] = (users[1:] != users[:-1]) | (artists[1:] != artists[:-1])
+        self._set_table(users[first], artists[first], plays[first])
+
+    @classmethod
+    def from_arrays(cls, users, artists, plays):
+        """
+        :param users: userIDs of the table rows, sorted by (artistID, userID) without duplicated pairs
+        :param artists: artistIDs of the table rows
+        :param plays: #plays of the table rows
+        :return: PlayCounts over the given (possibly memory-mapped) arrays
+        """
+        table = cls.__new__(cls)
+        table._set_table(users, artists, plays)
+        return table
+
+    def _set_table(self, users, artists, plays):
+        self.users, self.artists, self.plays = users, artists, plays
+        self.artist_ids, starts = np.unique(self.artists, return_index=True)
+        self.artist_ptr = np.append(starts, len(self.users))
+        self._index = None
+
+    def __getitem__(self, pair):
+        """
+        :param pair: (userID, artistID)
+        :return: #plays of the user for the artist (0 if the user never played the artist)
+        """
+        if self._index is None:  # built on the first lookup only
+            self._index = dict(zip(zip(self.users.tolist(), self.artists.tolist()), self.plays.tolist()))
+        return self._index.get(pair, 0)
+
+    def h(self, users, artist):
+        """
+        h value of every user for the artist
+        :param users: userIDs (e.g. G.nodes)
+        :param artist: artistID
+        :return: np.array of #plays, 0 for users that never played the artist
+        """
+        users = np.asarray(list(users), dtype=np.int64)
+        h = np.zeros(len(users), dtype=np.int64)
+        a = np.searchsorted(self.artist_ids, artist)
+        if a == len(self.artist_ids) or self.artist_ids[a] != artist:
+            return h
+        artist_users = self.users[self.artist_ptr[a]:self.artist_ptr[a + 1]]
+        artist_plays = self.plays[self.artist_ptr[a]:self.artist_ptr[a + 1]]
+        position = np.minimum(np.searchsorted(artist_users, users), len(artist_users) - 1)
+        found = artist_users[position] == users
+        h[found] = artist_plays[position[found]]
+        return h
+
+    def h_matrix(self, users, artists):
+        """
+        h values of every user for several artists at once
+        :param users: userIDs (e.g. G.nodes)
+        :param artists: list of artistIDs
+        :return: |users| x |artists| np.array of #plays
+        """
+        users = np.asarray(list(users), dtype=np.int64)
+        return np.column_stack([self.h(users, artist) for artist in artists]).reshape(len(users), len(artists))
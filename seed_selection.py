@@ -0,0 +1,244 @@
+import heapq
+import time
+
+import numpy as np
+
+import instrumentation
+from csr_graph import _buying_probability_deltas, as_csr_graph
+from simulation import bitsliced_infections, monte_carlo_infections
+
+
+def _acceptance(G):
+    """
+    the buying probability of node n is w[n] * bt / nt, where w is 1 if h == 0 and else h / 1000
+    :return: np.array w of every node
+    """
+    return np.where(G.h == 0, 1.0, G.h / 1000)
+
+
+def degree_discount(G, k):
+    """
+    Degree-discount heuristic for the buying probability model.
+    The weight of node n is the increase of its buying probability per infected friend, w[n] / nt[n], so the score of
+    v is 1 + the weights of its friends that are not influencers yet (its one-hop IC gain). A candidate with t friends
+    in S is already infected with probability min(1, t * w[v] / nt[v]) by them, and its score is discounted by that
+    probability. Choosing an influencer only changes the scores of its friends, which only decrease, so the
+    candidates are kept in a lazy max-heap. Ties are broken in favor of the smallest userID.
+    :param G: network graph (CSRGraph or nx.Graph) with the h of the promoted artist
+    :param k: number of wanted influencers
+    :return: set S of k influencers
+    """
+    G = as_csr_graph(G)
+    n = len(G.ids)
+    w = _acceptance(G)
+    weights = w / G.degrees
+    reach = 1 + G.adjacency_matrix() @ weights  # 1 + weights of the friends that are not in S
+    t = np.zeros(n, dtype=np.int64)  # number of friends in S
+    version = np.zeros(n, dtype=np.int64)
+    chosen = np.zeros(n, dtype=bool)
+    heap = list(zip((-reach).tolist(), range(n), [0] * n))
+    heapq.heapify(heap)
+    S = []
+    while len(S) < k and heap:
+        neg_score, v, v_version = heapq.heappop(heap)
+        if chosen[v] or v_version != version[v]:
+            continue
+        S.append(v)
+        chosen[v] = True
+        for u in G.neighbor_indices(v).tolist():
+            if chosen[u]:
+                continue
+            t[u] += 1
+            reach[u] -= weights[v]
+            version[u] += 1
+            score = (1 - min(1.0, t[u] * weights[u])) * reach[u]
+            heapq.heappush(heap, (-score, u, int(version[u])))
+    return set(G.ids[S].tolist())
+
+
+class RISIndex:
+    """
+    Reverse influence sampling index of the infection process of the simulation.
+    The buying probability w[v] * bt / nt of v at a timestep is the probability that v picks one of its friends
+    uniformly at random, accepts it with probability w[v] and the picked friend is infected. A reverse-reachable set is
+    sampled from a random root by drawing these choices backwards over the timesteps: a node is infected at the end if
+    it was infected one timestep earlier or its accepted pick was. The set holds every node whose infection at time=0
+    infects the root by the last timestep, so the expected number of infected nodes of S is |V| times the fraction of
+    sets that S hits, and the best S is a maximum coverage problem.
+    The sets are kept in CSR form (members of set i are members[indptr[i]:indptr[i + 1]]) and can be saved, so top-k
+    queries for different k reuse the same samples.
+    """
+
+    def __init__(self, ids, indptr, members):
+        """
+        :param ids: sorted array of userIDs of the sampled graph
+        :param indptr: row pointers of the sets
+        :param members: dense indices of the nodes of every set
+        """
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.members = np.asarray(members, dtype=np.int32)
+
+    @classmethod
+    def sample(cls, G, num_sets, steps=6, rng=None):
+        """
+        :param G: network graph (CSRGraph or nx.Graph) with the h of the promoted artist
+        :param num_sets: number of reverse-reachable sets
+        :param steps: number of timesteps of the simulation
+        :param rng: np.random.Generator
+        :return: RISIndex of num_sets sets sampled from uniformly random roots. acceptance probabilities above 1 (h >
+                 1000) are capped at 1: min(1, w * bt / nt) with w > 1 is in general not the probability of a random
+                 choice of friends, so these nodes buy with probability bt / nt in the sampled model, and the
+                 coverage estimates are lower than the simulation.
+        """
+        G = as_csr_graph(G)
+        rng = np.random.default_rng() if rng is None else rng
+        n = len(G.ids)
+        w = np.minimum(_acceptance(G), 1)
+        set_ids = np.arange(num_sets, dtype=np.int64)
+        nodes = rng.integers(0, n, size=num_sets)
+        for t in range(steps):
+            # every (set, node) pair draws its own pick of this timestep
+            instrumentation.count("random draws", 2 * len(nodes))
+            accepted = rng.random(len(nodes)) < w[nodes]
+            src_sets, src_nodes = set_ids[accepted], nodes[accepted]
+            picks = G.indptr[src_nodes] + (rng.random(len(src_nodes)) * G.degrees[src_nodes]).astype(np.int64)
+            keys = np.sort(np.concatenate([set_ids * n + nodes, src_sets * n + G.indices[picks]]))
+            keys = keys[np.concatenate([[True], keys[1:] != keys[:-1]])]
+            set_ids, nodes = keys // n, keys % n
+        indptr = np.zeros(num_sets + 1, dtype=np.int64)
+        np.cumsum(np.bincount(set_ids, minlength=num_sets), out=indptr[1:])
+        return cls(G.ids, indptr, nodes)
+
+    def __len__(self):
+        return len(self.indptr) - 1
+
+    def select(self, k):
+        """
+        greedy maximum coverage: repeatedly take the node that hits most of the sets not hit yet (ties in favor of the
+        smallest userID)
+        :param k: number of wanted influencers
+        :return: (set S of k influencers, estimated number of infected nodes at the last timestep of the sampled
+                 model, where acceptance probabilities above 1 are capped)
+        """
+        n = len(self.ids)
+        set_of = np.repeat(np.arange(len(self)), np.diff(self.indptr))
+        by_node = np.argsort(self.members, kind='stable')  # positions of the members of every node
+        node_ptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.members, minlength=n), out=node_ptr[1:])
+        coverage = np.diff(node_ptr)
+        hit = np.zeros(len(self), dtype=bool)
+        S = []
+        for i in range(min(k, n)):
+            v = int(np.argmax(coverage))
+            S.append(v)
+            sets = set_of[by_node[node_ptr[v]:node_ptr[v + 1]]]
+            sets = sets[~hit[sets]]
+            hit[sets] = True
+            starts = self.indptr[sets]
+            lengths = self.indptr[sets + 1] - starts
+            positions = np.arange(lengths.sum()) + np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+            np.subtract.at(coverage, self.members[positions], 1)
+            coverage[v] = -1
+        return set(self.ids[S].tolist()), len(self.ids) * hit.sum() / max(len(self), 1)
+
+    def save(self, path):
+        """
+        :param path: .npz file
+        :return: None
+        """
+        np.savez(path, ids=self.ids, indptr=self.indptr, members=self.members)
+
+    @classmethod
+    def load(cls, path):
+        """
+        :param path: .npz file written by save
+        :return: RISIndex
+        """
+        with np.load(path) as arrays:
+            return cls(arrays['ids'], arrays['indptr'], arrays['members'])
+
+
+def ris(G, k, num_sets=100000, steps=6, rng=None):
+    """
+    seed selection by reverse influence sampling (see RISIndex). to answer several queries with the same samples,
+    build the RISIndex once and call its select.
+    :param G: network graph (CSRGraph or nx.Graph) with the h of the promoted artist
+    :param k: number of wanted influencers
+    :return: set S of k influencers
+    """
+    return RISIndex.sample(G, num_sets, steps, rng).select(k)[0]
+
+
+def swap_local_search(G, S, time_budget=None, verify=None):
+    """
+    Refine a set of influencers by single swaps (remove s, add v) while IC improves.
+    IC(S) = |S| + the buying probabilities (test) of the friends of S, so it is kept as the number of friends in S of
+    every node (bt). The gain of adding v given S is 1 + the increase of the probabilities of v's friends, kept for all
+    nodes. Removing s only changes the increases of s's friends, so the gains of all candidates without s are updated
+    from their rows of the adjacency matrix only, and every swap of s is scored at once as (gain of v without s) - (loss
+    of s). The best swap is taken until no swap improves IC (a local optimum) or the time budget runs out.
+    :param G: network graph (CSRGraph or nx.Graph) with the h of the promoted artist
+    :param S: set of influencers to start from (userIDs)
+    :param time_budget: maximal number of seconds (None - until a local optimum)
+    :param verify: optional function S -> score, e.g. monte_carlo_objective. the refined set is returned only if its
+                   score is at least the score of S.
+    :return: set of influencers of the same size as S
+    """
+    G = as_csr_graph(G)
+    start = time.perf_counter()
+    A = G.adjacency_matrix().astype(np.float64)
+    seeds = [int(i) for i in G.index_of(S)]
+    in_S = np.zeros(len(G.ids), dtype=bool)
+    in_S[seeds] = True
+    bt = np.asarray(A @ in_S.astype(np.float64)).astype(np.int64)
+    deltas = _buying_probability_deltas(G, bt)
+    gains = 1 + A @ deltas
+    while time_budget is None or time.perf_counter() - start < time_budget:
+        best_delta, best_swap = 1e-12, None
+        for s in seeds:
+            friends = G.neighbor_indices(s)
+            bt[friends] -= 1
+            change = _buying_probability_deltas(G, bt, friends) - deltas[friends]
+            loss = 1 + (deltas[friends] + change).sum()  # IC(S) - IC(S - s): the increases at bt - 1
+            swap_gains = gains + A[friends].T @ change - loss
+            bt[friends] += 1
+            swap_gains[in_S] = -np.inf
+            instrumentation.count("swap evaluations", len(G.ids))
+            v = int(np.argmax(swap_gains))  # the smallest userID on ties
+            if swap_gains[v] > best_delta:
+                best_delta, best_swap = swap_gains[v], (s, v)
+        if best_swap is None:
+            break
+        s, v = best_swap
+        seeds[seeds.index(s)] = v
+        in_S[s], in_S[v] = False, True
+        changed = np.union1d(G.neighbor_indices(s), G.neighbor_indices(v))
+        bt[G.neighbor_indices(s)] -= 1
+        bt[G.neighbor_indices(v)] += 1
+        change = _buying_probability_deltas(G, bt, changed) - deltas[changed]
+        deltas[changed] += change
+        gains += A[changed].T @ change
+    refined = set(G.ids[seeds].tolist())
+    if verify is not None and refined != set(S) and verify(refined) < verify(set(S)):
+        return set(S)
+    return refined
+
+
+def monte_carlo_objective(G, replicas=1000, steps=6, P=None, seed=0):
+    """
+    :param G: network graph at time=0 with the h of the promoted artist (CSRGraph)
+    :param replicas: number of replicas per evaluation
+    :param steps: number of timesteps
+    :param P: new edges probabilities (edge_formation.PairProbabilities) or None for no new edges
+    :param seed: random seed. every evaluation uses the same seed, so different sets are compared on common random
+                 numbers.
+    :return: function S -> mean number of infected nodes after the last timestep (simulation.monte_carlo_infections,
+             on the bit-sliced engine without new edges)
+    """
+    def objective(S):
+        rng = np.random.default_rng(seed)
+        if P is None:
+            return bitsliced_infections(G, S, replicas, steps, rng)[:, -1].mean()
+        return monte_carlo_infections(G, S, replicas, steps, P, rng)[:, -1].mean()
+    return objective
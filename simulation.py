@@ -0,0 +1,183 @@
+import numpy as np
+import pandas as pd
+import scipy.stats
+
+import instrumentation
+from csr_graph import _buying_probability
+from edge_formation import sample_new_edges
+
+
+def monte_carlo_infections(G, influencers, replicas=100, steps=6, P=None, rng=None):
+    """
+    Run independent replicas of the simulation of the __main__ block at once. The infection state of all replicas is
+    an R x |V| boolean matrix, the infected friends of every node in every replica are one sparse product and the
+    Bernoulli draws of a timestep are one batch of random numbers.
+    Like the simulation loop, at every timestep each node that is not infected yet gets infected with its buying
+    probability, and between timesteps every replica forms its own new edges according to P. P is the same model on
+    every day (the simulation loop rebuilds it daily; with friendly_index that rebuild also sees the new degrees).
+    :param G: network graph at time=0 with the h of the promoted artist (CSRGraph). G itself is not changed.
+    :param influencers: set of influencers (userIDs), infected at time=0
+    :param replicas: number of independent replicas R
+    :param steps: number of timesteps
+    :param P: new edges probabilities (edge_formation.PairProbabilities) or None for no new edges
+    :param rng: np.random.Generator
+    :return: R x steps np.array, number of infected nodes of every replica after every timestep
+    """
+    rng = np.random.default_rng() if rng is None else rng
+    n = len(G.ids)
+    A = G.adjacency_matrix()
+    h = G.h[None, :]
+    infected = np.zeros((replicas, n), dtype=bool)
+    infected[:, G.index_of(influencers)] = True
+    # edges formed in the replicas: replica, both endpoints, and keys of the pairs already added per replica
+    new_replica = np.zeros(0, dtype=np.int64)
+    new_u = np.zeros(0, dtype=np.int64)
+    new_v = np.zeros(0, dtype=np.int64)
+    new_keys = [np.zeros(0, dtype=np.int64) for _ in range(replicas)]
+
+    def buying_probability():
+        x = infected.astype(np.int64)
+        bt = (A @ x.T).T
+        nt = np.tile(G.degrees, (replicas, 1))
+        if len(new_replica):
+            np.add.at(bt, (new_replica, new_u), x[new_replica, new_v])
+            np.add.at(bt, (new_replica, new_v), x[new_replica, new_u])
+            np.add.at(nt, (new_replica, new_u), 1)
+            np.add.at(nt, (new_replica, new_v), 1)
+        return _buying_probability(h, bt, nt)
+
+    counts = np.zeros((replicas, steps), dtype=np.int64)
+    probability = buying_probability()
+    for t in range(steps):
+        instrumentation.count("random draws", replicas * n)
+        u = rng.random((replicas, n))
+        infected |= probability > u
+        counts[:, t] = infected.sum(axis=1)
+        if t < steps - 1:
+            if P is not None:
+                replica_edges = []
+                for r in range(replicas):
+                    rows, cols = sample_new_edges(G, P, rng)
+                    keys = rows * n + cols
+                    fresh = ~np.isin(keys, new_keys[r])  # already formed in this replica on a previous day
+                    new_keys[r] = np.union1d(new_keys[r], keys[fresh])
+                    replica_edges.append((np.full(fresh.sum(), r), rows[fresh], cols[fresh]))
+                new_replica = np.concatenate([new_replica] + [e[0] for e in replica_edges])
+                new_u = np.concatenate([new_u] + [e[1] for e in replica_edges])
+                new_v = np.concatenate([new_v] + [e[2] for e in replica_edges])
+            probability = buying_probability()
+    return counts
+
+
+def _replica_counts(X, replicas, block=1 << 12):
+    """
+    :param X: |V| x W uint64 infection bitmasks (bit r % 64 of word r // 64 is replica r)
+    :return: np.array of the number of infected nodes of every replica
+    """
+    counts = np.zeros(X.shape[1] * 64, dtype=np.int64)
+    for start in range(0, len(X), block):
+        bits = np.unpackbits(X[start:start + block].view(np.uint8), axis=1, bitorder='little')
+        counts += bits.sum(axis=0, dtype=np.int64)
+    return counts[:replicas]
+
+
+def bitsliced_infections(G, influencers, replicas=1024, steps=6, rng=None, block=1 << 20):
+    """
+    monte_carlo_infections without new edges, for thousands of replicas. The infection state of 64 replicas is packed
+    in one uint64 word per node, so the state is a |V| x ceil(R / 64) bitmask matrix. The infected friends of every
+    node in every replica are counted with a bit-sliced ripple-carry adder: bit plane b holds bit b of the counters of
+    64 replicas per word, and adding a friend's word to them costs a few word operations for 64 replicas at once. The
+    nodes are kept in descending degree order, so the nodes that have a j-th friend are a prefix of the arrays and
+    every addition is a contiguous slice operation.
+    The Bernoulli draws of a timestep are made for the nodes that have an infected friend in some replica, in blocks
+    of about `block` draws: the counters of a block of those nodes are unpacked and compared with the buying
+    probability formula of calc_buying_probability, so the memory of a timestep does not grow with |V| x R.
+    :param G: network graph at time=0 with the h of the promoted artist (CSRGraph). G itself is not changed.
+    :param influencers: set of influencers (userIDs), infected at time=0
+    :param replicas: number of independent replicas R
+    :param steps: number of timesteps
+    :param rng: np.random.Generator
+    :param block: number of (node, replica) draws unpacked at once
+    :return: R x steps np.array, number of infected nodes of every replica after every timestep
+    """
+    rng = np.random.default_rng() if rng is None else rng
+    n = len(G.ids)
+    words = -(-replicas // 64)
+    order = np.argsort(-G.degrees, kind='stable')  # node of every position
+    position = np.empty(n, dtype=np.int64)
+    position[order] = np.arange(n)
+    degrees = G.degrees[order]
+    h = G.h[order][:, None]
+    nt = degrees[:, None]
+    # friends[j]: position of the j-th friend of the first len(friends[j]) positions (the nodes of degree > j)
+    max_degree = int(degrees.max()) if n else 0
+    with_friend = np.searchsorted(-degrees, -np.arange(max_degree), side='left')
+    friends = [position[G.indices[G.indptr[order[:with_friend[j]]] + j]] for j in range(max_degree)]
+    num_planes = max(max_degree.bit_length(), 1)
+
+    X = np.zeros((n, words), dtype=np.uint64)
+    X[position[G.index_of(influencers)]] = ~np.uint64(0)
+    counts = np.zeros((replicas, steps), dtype=np.int64)
+    for t in range(steps):
+        planes = np.zeros((num_planes, n, words), dtype=np.uint64)
+        for j in range(max_degree):
+            size = with_friend[j]
+            carry = X[friends[j]]
+            for b in range(num_planes):
+                plane = planes[b, :size]
+                plane ^= carry
+                carry &= ~plane  # the bits that were 1 before adding carry
+                if not carry.any():
+                    break
+        active = np.flatnonzero(planes.any(axis=(0, 2)))
+        rows = max(block // (words * 64), 1)
+        for start in range(0, len(active), rows):
+            nodes = active[start:start + rows]
+            bt = np.zeros((len(nodes), words * 64), dtype=np.int64)
+            for b in range(num_planes):
+                bits = np.unpackbits(planes[b, nodes].view(np.uint8), axis=1, bitorder='little')
+                bt += bits.astype(np.int64) << b
+            instrumentation.count("random draws", bt.size)
+            u = rng.random(bt.shape)
+            infected = _buying_probability(h[nodes], bt, nt[nodes]) > u
+            X[nodes] |= np.packbits(infected, axis=1, bitorder='little').view(np.uint64)
+        counts[:, t] = _replica_counts(X, replicas)
+    return counts
+
+
+def summarize_infections(counts, confidence=0.95):
+    """
+    :param counts: R x steps np.array of infected nodes per replica and timestep (monte_carlo_infections)
+    :param confidence: confidence level of the intervals
+    :return: pd.DataFrame with one row per timestep: mean, variance and the t-distribution confidence interval of the
+             mean number of infected nodes
+    """
+    replicas = counts.shape[0]
+    mean = counts.mean(axis=0)
+    variance = counts.var(axis=0, ddof=1) if replicas > 1 else np.zeros(counts.shape[1])
+    half_width = (scipy.stats.t.ppf((1 + confidence) / 2, max(replicas - 1, 1)) * np.sqrt(variance / replicas))
+    return pd.DataFrame({'time': np.arange(1, counts.shape[1] + 1), 'mean': mean, 'variance': variance,
+                         'ci_low': mean - half_width, 'ci_high': mean + half_width})
+
+
+def monte_carlo(G, influencers, replicas=100, steps=6, P=None, confidence=0.95, rng=None, bitsliced=False):
+    """
+    Monte Carlo evaluation of a set of influencers for the artist whose h values are set on G
+    :param G: network graph at time=0 (CSRGraph)
+    :param influencers: set of influencers (userIDs)
+    :param replicas: number of independent replicas
+    :param steps: number of timesteps
+    :param P: new edges probabilities (edge_formation.PairProbabilities) or None for no new edges
+    :param confidence: confidence level of the intervals
+    :param rng: np.random.Generator
+    :param bitsliced: boolean. True to run the replicas on the bit-sliced engine (bitsliced_infections), only without
+                      new edges (P None)
+    :return: pd.DataFrame of infections per timestep (see summarize_infections)
+    """
+    if bitsliced:
+        if P is not None:
+            raise ValueError("the bit-sliced engine does not form new edges")
+        counts = bitsliced_infections(G, influencers, replicas, steps, rng)
+    else:
+        counts = monte_carlo_infections(G, influencers, replicas, steps, P, rng)
+    return summarize_infections(counts, confidence)
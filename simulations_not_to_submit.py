@@ -2,6 +2,10 @@ import sys
 import networkx as nx
 import random
 import pandas as pd
+import data_cache
+import experiment_grid
+import graph_overlay
+import play_counts
 
 
 def load_data():
@@ -199,7 +203,7 @@ def common_neighbors_index(G_0, G_1, u, v, hist):
                  friends that the two nodes had in time=-1.
     :return: probability of (u,v) edge to form
     """
-    common_neighbors = len(set(nx.common_neighbors(G_1, u, v)))
+    common_neighbors = len(set(G_1.neighbors(u)) & set(G_1.neighbors(v)) - {u, v})
     return hist[common_neighbors]
 
 
@@ -223,7 +227,7 @@ def new_edges_by_commoneighbors_histogram(G_0, G_1):
         if e not in G_1.edges:  # means that edge was formed between t=-1 and t=0
             u = e[0]
             v = e[1]
-            common_num = len(set((nx.common_neighbors(G_1, u, v))))
+            common_num = len(set(G_1.neighbors(u)) & set(G_1.neighbors(v)) - {u, v})
             histogram[common_num] += 1
 
     # divide histogram values by total number of new edges between yesterday and today to form probability function
@@ -256,6 +260,17 @@ if __name__ == '__main__':
                    [117383, 74425, 961018, 197117, 457566]]
     new_edges_method_list = [common_neighbors_index, friendly_index, prob_p_forall_index(1/800), prob_p_forall_index(0)]
     finish_without_simulation = False  # if True the simulation itself will not run (time saving)
+    use_data_cache = False  # if True the inputs are loaded from binary snapshots of the csv files (see data_cache)
+    use_graph_overlay = False  # if True the simulated days are GraphOverlay layers over G_0 instead of nx.Graph copies
+    use_grid_runner = False  # if True the grid runs with experiment_grid: shared artifacts, process pool, results table
+    grid_processes = 4
+
+    if use_grid_runner:
+        grid = experiment_grid.run_grid({'artist': artist, 'influencers': influencers_list,
+                                         'methods': ['common_neighbors', 'friendly', 1 / 800, 0],
+                                         'processes': grid_processes})
+        print(grid.pivot_table(index=['influencers', 'method'], columns='time', values='infected'))
+        sys.exit("Finished grid")
 
     for influencers in influencers_list:
         for new_edges_method in new_edges_method_list:
@@ -264,23 +279,28 @@ if __name__ == '__main__':
             print(f"new edges method: {new_edges_method.__name__}")
 
             print("loading data...")
-            instaglam0, instaglam_1, spotifly = load_data()
+            if use_data_cache:
+                instaglam_1 = data_cache.load_edge_list('./instaglam_1.csv')
+                instaglam0 = data_cache.load_edge_list('./instaglam0.csv')
+                plays = data_cache.load_play_counts()
+            else:
+                instaglam0, instaglam_1, spotifly = load_data()
+                plays = play_counts.PlayCounts(spotifly)
 
             # build graphs
             print("building network...")
             G_1 = build_graph(instaglam_1)  # graph at time=-1
             G_0 = build_graph(instaglam0)  # graph at time=0
-            for n in G_0.nodes:  # initialization of properties foreach node
-                G_0.nodes[n]["buying probability"] = 0
-                G_0.nodes[n]["infected"] = False
-                G_0.nodes[n]["buying probability test"] = 0
-                G_0.nodes[n]["infected test"] = False
-                filt = (spotifly['userID'] == n) & (spotifly[' artistID'] == artist)
-                G_0.nodes[n]["h"] = 0 if spotifly.loc[filt, '#plays'].empty else list(spotifly.loc[filt, '#plays'])[0]
+            # initialization of properties foreach node (build_graph already set the others)
+            nx.set_node_attributes(G_0, dict(zip(G_0.nodes, plays.h(G_0.nodes, artist).tolist())), name="h")
 
             # simulate creation of new edges in the graph
-            G_random = nx.Graph(G_0)
-            G_random_prev = nx.Graph(G_1)
+            if use_graph_overlay:
+                G_random = graph_overlay.GraphOverlay(G_0)  # new edges are layered over G_0 instead of copying it
+                G_random_prev = G_1
+            else:
+                G_random = nx.Graph(G_0)
+                G_random_prev = nx.Graph(G_1)
             histogram = None
             if new_edges_method != prob_p_forall_index(0):
                 print("simulating creation of new edges in the network...")
@@ -291,7 +311,10 @@ if __name__ == '__main__':
                         histogram = new_edges_by_commoneighbors_histogram(G_0=G_random, G_1=G_random_prev)
                         P = build_probabilities_dict(G_random, probability_function=common_neighbors_index,
                                                      hist=histogram)
-                        G_random_prev = nx.Graph(G_random)
+                        if use_graph_overlay:
+                            G_random_prev, G_random = G_random, G_random.layer()  # yesterday is kept as it is
+                        else:
+                            G_random_prev = nx.Graph(G_random)
                     add_new_edges(G_random, P)
 
             print(f"influencers: {influencers}")
@@ -323,7 +346,8 @@ if __name__ == '__main__':
                     if new_edges_method != common_neighbors_index:
                         P = build_probabilities_dict(G_0, probability_function=new_edges_method)
                     else:
-                        P = build_probabilities_dict(G_random, probability_function=common_neighbors_index,
+                        # G_0 has the nodes of G_random, so the simulated network is not used (nor changed) any more
+                        P = build_probabilities_dict(G_0, probability_function=common_neighbors_index,
                                                      hist=histogram)
                     add_new_edges(G_0, P)
                     # calc buying probability at time=t